@@ -1,6 +1,15 @@
 import os
 from pathlib import Path
 from lib.classes import Argument
+from lib.docker import docker_ping
+
+def __env_int__(name, default):
+    """ An integer (>= 0) from the environment variable `name`, or `default` when it is unset or invalid """
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError:
+        return default
+    return value if value >= 0 else default
 
 APP = {
     'name': 'aws-sso-login',
@@ -14,16 +23,49 @@ ARGUMENTS = {
     "config": {
         "awscli": Argument(
             label="aws config",
-            help="Path to 'aws' config file.",
-            value=f"{Path.home()}{os.sep}.aws{os.sep}config",
+            help="Path to 'aws' config file (AWS_CONFIG_FILE). Fragments in '<file>.d' are merged in.",
+            value=os.environ.get("AWS_CONFIG_FILE", f"{Path.home()}{os.sep}.aws{os.sep}config"),
             stop_options=["do_login", "do_eks", "do_ecr"]
         ),
         "eks": Argument(
             label="eks config",
-            help="Path to 'eks_auth' config file.",
+            help="Path to 'eks_auth' config file. Fragments in '<file>.d' are merged in.",
             value=f"{Path.home()}{os.sep}.eks_auth",
             stop_options=["do_eks"]
         ),
+        "state": Argument(
+            label="state dir",
+            help="Directory for aws-sso-login state and cache files.",
+            value=f"{Path.home()}{os.sep}.aws{os.sep}aws-sso-login",
+            stop_options=[]
+        ),
+        "metrics": Argument(
+            label="metrics file",
+            help="Path of the OpenMetrics textfile written after each run (for node_exporter's textfile collector).",
+            value=os.environ.get(
+                "AWS_SSO_LOGIN_METRICS_FILE",
+                f"{Path.home()}{os.sep}.aws{os.sep}aws-sso-login{os.sep}aws-sso-login.prom"
+            ),
+            stop_options=[]
+        ),
+        "logs": Argument(
+            label="log dir",
+            help="Directory for the full output log of each run.",
+            value=f"{Path.home()}{os.sep}.aws{os.sep}aws-sso-login{os.sep}logs",
+            stop_options=[]
+        ),
+        "kube_shards": Argument(
+            label="kubeconfig dir",
+            help="Write one kubeconfig per EKS context into this directory (clusters without KUBE_CONFIG). Disabled when empty.",
+            value=os.environ.get("AWS_SSO_LOGIN_KUBECONFIG_DIR"),
+            stop_options=[]
+        ),
+        "output_lines": Argument(
+            label="output lines",
+            help="Maximum number of lines kept in the output window. The full output is in the run log.",
+            value=__env_int__("AWS_SSO_LOGIN_OUTPUT_LINES", 2000),
+            stop_options=[]
+        ),
     },
     "cmd": {
         "awscli": Argument(
@@ -49,7 +91,10 @@ ARGUMENTS = {
             bin="docker",
             stop_options=["do_ecr"],
             url="https://docs.docker.com/get-docker/",
-            verification={"version": {"args": "--version", "regex": ""}, "alive": {"args": "ps"}}
+            verification={
+                "version": {"args": "--version", "regex": ""},
+                "alive": {"probe": docker_ping, "timeout": 1.0, "cli_timeout": 5.0, "args": "version --format {{.Server.Version}}"}
+            }
 
         ),
     },
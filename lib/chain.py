@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import threading
+from time import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from lib.sso import SsoCache, parse_timestamp
+from lib.classes import run_command
+from lib.throttle import call_with_retry
+
+# The aws cli refreshes assumed role credentials 15 minutes before they expire,
+# so only hand it credentials that are valid for longer than that
+CHAIN_EXPIRY_WINDOW = 900
+
+class ChainError(Exception):
+    pass
+
+def assume_role_kwargs(profile):
+    """ The AssumeRole arguments of a profile, as the aws cli builds them """
+    kwargs = {"RoleArn": profile.role_arn}
+    if profile.role_session_name:
+        kwargs["RoleSessionName"] = profile.role_session_name
+    if profile.external_id:
+        kwargs["ExternalId"] = profile.external_id
+    if profile.mfa_serial:
+        kwargs["SerialNumber"] = profile.mfa_serial
+    if profile.duration_seconds:
+        kwargs["DurationSeconds"] = int(profile.duration_seconds)
+    return kwargs
+
+def cache_key(profile):
+    """ The aws cli (botocore) assume-role cache key: sha1 of the AssumeRole arguments without the session name """
+    kwargs = assume_role_kwargs(profile)
+    kwargs.pop("RoleSessionName", None)
+    return hashlib.sha1(json.dumps(kwargs, sort_keys=True).encode("utf-8")).hexdigest()
+
+class RoleChain:
+    """
+    Assume the roles of chained (source_profile/role_arn) profiles, hop by hop from the SSO role
+    credentials. Every hop is memoized until it expires, in memory and in the aws cli's assume-role
+    cache, so profiles sharing a hop assume it once and later cli calls do not assume it again.
+    """
+    def __init__(self, awscli, limiter, retry_policy, retry_stats=None, sso_cache=None, cli_cache_dir=None, max_workers=8, timeout=None):
+        self.awscli = awscli
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.retry_stats = retry_stats
+        self.sso_cache = sso_cache or SsoCache()
+        self.cli_cache_dir = cli_cache_dir or f"{Path.home()}{os.sep}.aws{os.sep}cli{os.sep}cache"
+        self.max_workers = max_workers
+        # Seconds before an `sts assume-role` command is killed (None: no limit)
+        self.timeout = timeout
+        self.memo = {}
+        self.lock = threading.Lock()
+        self.hop_locks = {}
+        self.assumed = 0
+
+    def __hop_lock__(self, key):
+        with self.lock:
+            return self.hop_locks.setdefault(key, threading.RLock())
+
+    def __valid__(self, credentials):
+        expires = parse_timestamp(credentials.get("Expiration")) if credentials else None
+        return bool(expires and expires - CHAIN_EXPIRY_WINDOW > time())
+
+    def __cache_path__(self, key):
+        return f"{self.cli_cache_dir}{os.sep}{key}.json"
+
+    def __read_cache__(self, key):
+        try:
+            with open(self.__cache_path__(key), "r") as f:
+                return json.load(f).get("Credentials")
+        except Exception:
+            return None
+
+    def __write_cache__(self, key, response):
+        os.makedirs(self.cli_cache_dir, exist_ok=True)
+        path = self.__cache_path__(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(response, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+
+    def credentials(self, profile):
+        """ Credentials (AccessKeyId, SecretAccessKey, SessionToken, Expiration) of a profile """
+        if not profile.is_chained:
+            credentials = self.sso_cache.load_role_credentials(
+                profile.sso_start_url, profile.sso_account_id, profile.sso_role_name, window=CHAIN_EXPIRY_WINDOW
+            )
+            if not credentials:
+                raise ChainError(f"No valid SSO credentials for [{profile.name}]. Login to AWS SSO first.")
+            return credentials
+
+        key = cache_key(profile)
+        # One lock per hop: profiles sharing a hop wait for the first one to assume it
+        with self.__hop_lock__(key):
+            with self.lock:
+                credentials = self.memo.get(key)
+            if not self.__valid__(credentials):
+                credentials = self.__read_cache__(key)
+            if not self.__valid__(credentials):
+                response = self.__assume_role__(profile, self.credentials(profile.source))
+                self.__write_cache__(key, response)
+                credentials = response["Credentials"]
+            with self.lock:
+                self.memo[key] = credentials
+            return credentials
+
+    def __assume_role__(self, profile, source):
+        if profile.mfa_serial:
+            raise ChainError(f"Profile [{profile.name}] requires MFA (mfa_serial). Use the aws cli for this profile.")
+        kwargs = assume_role_kwargs(profile)
+        args = [
+            "sts", "assume-role",
+            "--role-arn", kwargs["RoleArn"],
+            "--role-session-name", kwargs.get("RoleSessionName", f"aws-sso-login-{int(time())}"),
+            "--region", f"{profile.region}",
+            "--output", "json"
+        ]
+        if "ExternalId" in kwargs:
+            args.extend(["--external-id", kwargs["ExternalId"]])
+        if "DurationSeconds" in kwargs:
+            args.extend(["--duration-seconds", str(kwargs["DurationSeconds"])])
+        # Assume the role with the source credentials only, not a profile from the config files
+        env = {key: value for key, value in os.environ.items() if key not in ("AWS_PROFILE", "AWS_DEFAULT_PROFILE")}
+        env.update({
+            "AWS_ACCESS_KEY_ID": source["AccessKeyId"],
+            "AWS_SECRET_ACCESS_KEY": source["SecretAccessKey"],
+            "AWS_SESSION_TOKEN": source["SessionToken"],
+        })
+        exit_code, output = call_with_retry(
+            lambda: run_command(self.awscli, args, env=env, merge_stderr=False, timeout=self.timeout),
+            "sts", profile.region, self.limiter, self.retry_policy, self.retry_stats
+        )
+        if exit_code != 0:
+            reason = output.strip().splitlines()[-1] if output.strip() else "unknown"
+            raise ChainError(f"AssumeRole {kwargs['RoleArn']} failed: {reason}")
+        try:
+            response = json.loads(output)
+            response["Credentials"]["AccessKeyId"]
+        except (ValueError, KeyError, TypeError):
+            raise ChainError(f"AssumeRole {kwargs['RoleArn']} returned an unexpected response")
+        with self.lock:
+            self.assumed += 1
+        return response
+
+    def resolve(self, profiles, wait=None, durations=None):
+        """
+        Assume the role chains of profiles concurrently. Returns {profile name: credentials or Exception}.
+        `wait(seconds)` is called while waiting so a UI can keep processing events.
+        """
+        def timed(profile):
+            started = time()
+            try:
+                return self.credentials(profile)
+            finally:
+                if durations is not None:
+                    durations[profile.name] = time() - started
+
+        results = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {profile.name: executor.submit(timed, profile) for profile in profiles}
+        try:
+            if wait:
+                while not all(future.done() for future in futures.values()):
+                    wait(0.05)
+        except BaseException:
+            # Cancelled (wait raised): drop the queued profiles instead of running them all first
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
@@ -5,7 +5,32 @@ import shlex
 import platform
 import fileinput
 from pathlib import Path
-from configparser import ConfigParser
+from lib.kubeshards import shard_path
+from lib.layered import LayeredConfig
+
+def run_command(command, args, env=None, input=None, timeout=None, merge_stderr=True):
+    """
+    Run a command to completion (outside the Qt event loop) and return (exit code, output).
+    With merge_stderr=False only stdout is returned on success (stderr is still returned on failure).
+    """
+    try:
+        result = subprocess.run(
+            [command] + list(args),
+            input=input,
+            env=env,
+            timeout=timeout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+            text=True
+        )
+        if merge_stderr or result.returncode == 0:
+            return result.returncode, result.stdout
+        return result.returncode, f"{result.stdout}{result.stderr}"
+    except subprocess.TimeoutExpired:
+        # Not "Read timeout" (a transient aws cli error): the retry policy must not retry our own timeout
+        return 1, f"Command timed out after {timeout}s: {shlex.quote(command)}"
+    except OSError as e:
+        return 1, str(e)
 
 class Argument():
     def __init__(self,
@@ -36,17 +61,31 @@ class AwsProfile:
             'sso_region',
             'source_profile',
             'role_arn',
+            'role_session_name',
+            'external_id',
+            'duration_seconds',
+            'mfa_serial',
             'sso_account_id',
             'sso_role_name',
             'sso_start_url',
             'code_artifact_domain',
-            'code_artifact_env_file'
+            'code_artifact_env_file',
+            'code_artifact_repository',
+            'code_artifact_tools',
+            'ecr_regions',
+            'ecr_registry_ids'
         )
         self.section = section
         self.ecr_password = None
         self.enabled = True
         self.code_artifact_domain = None
         self.code_artifact_env_file = None
+        # Role chain (source_profile links), resolved by Initialize: [sso profile, ..., self]
+        self.source = None
+        self.chain = [self]
+        # The config file the section was taken from and the files it overrides, set by Initialize
+        self.source_file = None
+        self.source_overrides = []
         aws_sso_login = self.__get_config_attribute__(aws_config, "aws_sso_login")
         if aws_sso_login:
             self.enabled = self.__str_to_bool__(aws_sso_login)
@@ -57,6 +96,24 @@ class AwsProfile:
             # print(f"[{self.name}] Setting {attr} = {self.__get_config_attribute__(aws_config, attr)}")
             setattr(self, attr, self.__get_config_attribute__(aws_config, attr))
 
+    @property
+    def is_chained(self):
+        """ True for an assume-role profile that chains off another profile """
+        return bool(self.role_arn and self.source_profile)
+
+    @property
+    def root(self):
+        """ The SSO profile at the start of the role chain """
+        return self.chain[0]
+
+    @property
+    def account_id(self):
+        """ The account of the profile: the account of its role, or its SSO account """
+        if self.is_chained:
+            parts = self.role_arn.split(":")
+            return parts[4] if len(parts) > 5 else None
+        return self.sso_account_id
+
     def __str_to_bool__(self, value):
         """ Convert a string to a boolean value """
         return value.lower() in ("yes", "true", "t", "1")
@@ -68,13 +125,15 @@ class AwsProfile:
             return None
 
 class KubeConfig:
-    def __init__(self, eks_config, section):
+    def __init__(self, eks_config, section, shard_dir=None):
         self.config_attrs = ('ENABLE', 'AWS_REGION', 'EKS_CLUSTER', 'AWS_PROFILE', 'AWS_PARTITION', 'ROLE', 'KUBE_CONFIG')
         self.context = section
         self.aws_profile = None
         self.aws_partition = "aws"
         self.enable = False
         self.kube_config = f"{Path.home()}{os.sep}.kube{os.sep}config"
+        self.source_file = None
+        self.source_overrides = []
         # Load the aws config attributes
         for attr in self.config_attrs:
             value = self.__get_config_attribute__(eks_config, attr)
@@ -86,6 +145,10 @@ class KubeConfig:
         else:
             self.enable = True
 
+        # Without an explicit KUBE_CONFIG, write the context to its own file when sharding is enabled
+        if shard_dir and not self.__get_config_attribute__(eks_config, "KUBE_CONFIG"):
+            self.kube_config = shard_path(shard_dir, self.context)
+
     def __get_config_attribute__(self, eks_config, attr: str):
         """ Get the value of an attribute from the eks_auth config file """
         try:
@@ -106,6 +169,8 @@ class Initialize:
         self.arguments = arguments
         self.aws_config = None
         self.eks_config = None
+        self.aws_layers = None
+        self.eks_layers = None
         self.profiles = {}
         self.kube_configs = {}
         self.system = f"{platform.system()}".lower()
@@ -137,20 +202,30 @@ class Initialize:
 
         self.__init_eks_auth__()
 
-        # Create parsers for the configuration files
+        # Create parsers for the configuration files (each merged with its <file>.d fragments)
         if self.arguments["config"]["awscli"].enabled:
-            self.aws_config = ConfigParser()
-            self.aws_config.read(os.path.expanduser(self.arguments["config"]["awscli"].value))
+            self.aws_layers = LayeredConfig(self.arguments["config"]["awscli"].value)
+            self.aws_config = self.aws_layers.parser
+            self.arguments["config"]["awscli"].errors.extend(self.aws_layers.errors)
         if self.arguments["config"]["eks"].enabled:
-            self.eks_config = ConfigParser()
-            self.eks_config.read(os.path.expanduser(self.arguments["config"]["eks"].value))
+            self.eks_layers = LayeredConfig(self.arguments["config"]["eks"].value)
+            self.eks_config = self.eks_layers.parser
+            self.arguments["config"]["eks"].errors.extend(self.eks_layers.errors)
 
         # Create a dictionary of profiles
         if self.aws_config:
+            self.arguments["options"]["do_cart"].total = 0
+            all_profiles = {}
             for section in self.aws_config.sections():
                 profile = AwsProfile(self.aws_config, section)
+                profile.source_file, profile.source_overrides = self.aws_layers.source(section)
+                all_profiles[profile.name] = profile
+
+            for profile in all_profiles.values():
+                if profile.is_chained and not self.__resolve_chain__(profile, all_profiles):
+                    continue
 
-                if profile.sso_start_url and profile.enabled:
+                if (profile.sso_start_url or profile.is_chained) and profile.enabled:
                     # If any of the profiles contains code_artifact_domain, enable the cart option
                     if profile.code_artifact_domain:
                         self.arguments["options"]["do_cart"].total += 1
@@ -163,7 +238,8 @@ class Initialize:
         # Create a dictionary of EKS clusters
         if self.eks_config:
             for section in self.eks_config.sections():
-                kube_config = KubeConfig(self.eks_config, section)
+                kube_config = KubeConfig(self.eks_config, section, shard_dir=self.arguments["config"]["kube_shards"].value)
+                kube_config.source_file, kube_config.source_overrides = self.eks_layers.source(section)
                 if kube_config.enable:
                     # Add the AWS Profile to the EKS cluster Config
                     if kube_config.aws_profile and kube_config.aws_profile in self.profiles:
@@ -171,6 +247,36 @@ class Initialize:
                     self.kube_configs[kube_config.context] = kube_config
             self.arguments["options"]["do_eks"].total = len(self.kube_configs)
 
+    def __resolve_chain__(self, profile, all_profiles):
+        """ Follow the source_profile links of a profile down to its SSO profile, detecting cycles """
+        chain = [profile]
+        while chain[-1].is_chained:
+            source = all_profiles.get(chain[-1].source_profile)
+            if source is None:
+                self.arguments["config"]["awscli"].errors.append(f"[WARNING] Profile [{profile.name}]: source_profile [{chain[-1].source_profile}] not found. Skipping...")
+                return False
+            if source in chain:
+                cycle = " -> ".join([p.name for p in chain] + [source.name])
+                self.arguments["config"]["awscli"].errors.append(f"[WARNING] Profile [{profile.name}]: source_profile cycle {cycle}. Skipping...")
+                return False
+            if len(source.chain) > 1:
+                # Already resolved through another profile
+                chain.extend(reversed(source.chain))
+                break
+            chain.append(source)
+        if not chain[-1].sso_start_url:
+            self.arguments["config"]["awscli"].errors.append(f"[WARNING] Profile [{profile.name}]: role chain does not start at an SSO profile. Skipping...")
+            return False
+
+        chain.reverse()
+        for idx, link in enumerate(chain):
+            link.chain = chain[:idx + 1]
+            link.source = chain[idx - 1] if idx else None
+            # The region is not inherited through source_profile, but the commands below need one
+            if not link.region:
+                link.region = chain[0].region or chain[0].sso_region
+        return True
+
     def __bin_search__(self, cmd):
         try:
             self.search_paths.extend(os.environ["PATH"].split(os.pathsep))
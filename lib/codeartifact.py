@@ -0,0 +1,286 @@
+import os
+import re
+import json
+import platform
+import xml.etree.ElementTree as ET
+from time import time
+from pathlib import Path
+from configparser import ConfigParser
+from urllib.parse import urlparse
+from lib.metrics import write_atomic
+
+# Repository endpoint format used by each package manager
+TOOL_FORMATS = {
+    "pip": "pypi",
+    "twine": "pypi",
+    "npm": "npm",
+    "maven": "maven",
+}
+DEFAULT_TOOLS = ("pip", "npm", "twine", "maven")
+# Repository endpoints rarely change; look them up again after this many seconds
+ENDPOINT_TTL = 7 * 24 * 3600
+# The xml declaration, comments, processing instructions and doctype before the root element
+XML_PROLOG_RE = re.compile(r"\s*(<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)", re.DOTALL)
+XML_ROOT_END_RE = re.compile(r"</[\w.-]*:?settings\s*>")
+
+def parse_tools(value):
+    """ Parse the comma separated `code_artifact_tools` profile setting """
+    if not value:
+        return list(DEFAULT_TOOLS)
+    return [tool.strip().lower() for tool in value.split(",") if tool.strip().lower() in TOOL_FORMATS]
+
+def set_ini_option(text, section, key, value):
+    """
+    Set (or with value None, remove) one option of an ini file in place, keeping the comments,
+    order and other options of the file. A value starting with a newline is written as
+    indented continuation lines.
+    """
+    lines = text.splitlines()
+    if value is None:
+        rendered = []
+    elif value.startswith("\n"):
+        rendered = [f"{key} ="] + [f"    {line}" for line in value.split("\n")[1:]]
+    else:
+        rendered = [f"{key} = {value}"]
+
+    start = next((idx for idx, line in enumerate(lines) if line.strip() == f"[{section}]"), None)
+    if start is None:
+        if rendered:
+            if lines and lines[-1].strip():
+                lines.append("")
+            lines.extend([f"[{section}]"] + rendered)
+        return "\n".join(lines) + "\n"
+    end = next((idx for idx in range(start + 1, len(lines)) if lines[idx].strip().startswith("[")), len(lines))
+
+    option = re.compile(rf"{re.escape(key)}\s*[=:]", re.IGNORECASE)
+    for idx in range(start + 1, end):
+        if lines[idx][:1].isspace() or not option.match(lines[idx]):
+            continue
+        # The option and its continuation lines
+        last = idx + 1
+        while last < end and lines[last][:1].isspace() and lines[last].strip():
+            last += 1
+        lines[idx:last] = rendered
+        return "\n".join(lines) + "\n"
+
+    # A new option goes after the last line of the section (before its trailing blank lines)
+    insert = end
+    while insert > start + 1 and not lines[insert - 1].strip():
+        insert -= 1
+    lines[insert:insert] = rendered
+    return "\n".join(lines) + "\n"
+
+class EndpointCache:
+    """ Repository endpoints per domain/owner/repository/format, persisted in the state dir """
+    def __init__(self, state_dir, ttl=ENDPOINT_TTL):
+        self.path = f"{os.path.expanduser(state_dir)}{os.sep}codeartifact-endpoints.json"
+        self.ttl = ttl
+        self.endpoints = {}
+        try:
+            with open(self.path, "r") as f:
+                self.endpoints = json.load(f)
+        except Exception:
+            pass
+
+    def __key__(self, domain, owner, repository, fmt):
+        return f"{domain}/{owner}/{repository}/{fmt}"
+
+    def get(self, domain, owner, repository, fmt):
+        cached = self.endpoints.get(self.__key__(domain, owner, repository, fmt))
+        if cached and time() - cached["updated"] < self.ttl:
+            return cached["endpoint"]
+        return None
+
+    def set(self, domain, owner, repository, fmt, endpoint):
+        self.endpoints[self.__key__(domain, owner, repository, fmt)] = {"endpoint": endpoint, "updated": time()}
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.endpoints, indent=2, sort_keys=True))
+
+class CodeArtifactRepository:
+    def __init__(self, domain, owner, repository, token, endpoints, tools, primary=False):
+        self.domain = domain
+        self.owner = owner
+        self.repository = repository
+        self.token = token
+        self.endpoints = endpoints
+        self.tools = tools
+        self.primary = primary
+        self.server_id = "codeartifact" if primary else f"codeartifact-{domain}-{repository}"
+
+    def endpoint(self, tool):
+        endpoint = self.endpoints.get(TOOL_FORMATS[tool])
+        if endpoint and not endpoint.endswith("/"):
+            endpoint = f"{endpoint}/"
+        return endpoint
+
+class PackageManagerConfig:
+    """
+    Write CodeArtifact repository endpoints and tokens directly into the pip, npm,
+    twine (.pypirc) and maven configuration files. Each file is read once and
+    written once (atomically) for all repositories.
+    """
+    def __init__(self, repositories, home=None):
+        self.repositories = repositories
+        self.home = home or str(Path.home())
+        self.system = platform.system().lower()
+
+    def uses(self, tool):
+        return [repo for repo in self.repositories if tool in repo.tools and repo.endpoint(tool)]
+
+    def pip_conf(self):
+        if self.system == "windows":
+            return f"{os.environ.get('APPDATA', self.home)}{os.sep}pip{os.sep}pip.ini"
+        if os.path.isfile(f"{self.home}{os.sep}.pip{os.sep}pip.conf"):
+            return f"{self.home}{os.sep}.pip{os.sep}pip.conf"
+        return f"{self.home}{os.sep}.config{os.sep}pip{os.sep}pip.conf"
+
+    def npmrc(self):
+        return f"{self.home}{os.sep}.npmrc"
+
+    def pypirc(self):
+        return f"{self.home}{os.sep}.pypirc"
+
+    def maven_settings(self):
+        return f"{self.home}{os.sep}.m2{os.sep}settings.xml"
+
+    def write(self):
+        """ Write every configured package manager file. Returns the list of files written. """
+        written = []
+        for tool, path, render in (
+            ("pip", self.pip_conf(), self.__render_pip__),
+            ("npm", self.npmrc(), self.__render_npm__),
+            ("twine", self.pypirc(), self.__render_pypirc__),
+            ("maven", self.maven_settings(), self.__render_maven__),
+        ):
+            repositories = self.uses(tool)
+            if not repositories:
+                continue
+            existing = self.__read__(path)
+            content = render(existing, repositories)
+            if content != existing:
+                write_atomic(path, content)
+                written.append(path)
+        return written
+
+    def __read__(self, path):
+        if not os.path.isfile(path):
+            return ""
+        with open(path, "r") as f:
+            return f.read()
+
+    def __authenticated_url__(self, repo, tool):
+        url = urlparse(repo.endpoint(tool))
+        return f"{url.scheme}://aws:{repo.token}@{url.netloc}{url.path}simple/"
+
+    def __render_pip__(self, existing, repositories):
+        config = ConfigParser(interpolation=None)
+        config.read_string(existing)
+        hosts = [urlparse(repo.endpoint("pip")).netloc for repo in repositories]
+        # Keep extra indexes that do not belong to a CodeArtifact repository we manage
+        extra = [
+            url for url in config.get("global", "extra-index-url", fallback="").split()
+            if not any(host in url for host in hosts)
+        ]
+        urls = [self.__authenticated_url__(repo, "pip") for repo in repositories]
+        extra.extend(urls[1:])
+        content = set_ini_option(existing, "global", "index-url", urls[0])
+        return set_ini_option(content, "global", "extra-index-url", "\n" + "\n".join(extra) if extra else None)
+
+    def __render_npm__(self, existing, repositories):
+        registries = [repo.endpoint("npm") for repo in repositories]
+        auth_prefixes = [registry.split(":", 1)[1] for registry in registries]
+        lines = [
+            line for line in existing.splitlines()
+            if not line.strip().startswith("registry=")
+            and not any(line.strip().startswith(f"{prefix}:_authToken=") for prefix in auth_prefixes)
+        ]
+        lines.append(f"registry={registries[0]}")
+        for repo, prefix in zip(repositories, auth_prefixes):
+            lines.append(f"{prefix}:_authToken={repo.token}")
+        return "\n".join(lines) + "\n"
+
+    def __render_pypirc__(self, existing, repositories):
+        config = ConfigParser(interpolation=None)
+        config.read_string(existing)
+        servers = config.get("distutils", "index-servers", fallback="").split()
+        content = existing
+        for repo in repositories:
+            if repo.server_id not in servers:
+                servers.append(repo.server_id)
+            content = set_ini_option(content, repo.server_id, "repository", repo.endpoint("twine"))
+            content = set_ini_option(content, repo.server_id, "username", "aws")
+            content = set_ini_option(content, repo.server_id, "password", repo.token)
+        return set_ini_option(content, "distutils", "index-servers", "\n" + "\n".join(servers))
+
+    def __render_maven__(self, existing, repositories):
+        namespace = ""
+        if existing.strip():
+            # Keep the comments of the user's settings
+            root = ET.fromstring(existing, parser=ET.XMLParser(target=ET.TreeBuilder(insert_comments=True)))
+            if root.tag.startswith("{"):
+                namespace = root.tag[1:root.tag.index("}")]
+        else:
+            namespace = "http://maven.apache.org/SETTINGS/1.0.0"
+            root = ET.Element(f"{{{namespace}}}settings")
+        ET.register_namespace("", namespace)
+        ns = f"{{{namespace}}}" if namespace else ""
+
+        servers = self.__maven_child__(root, f"{ns}servers")
+        for repo in repositories:
+            server = self.__maven_find__(servers, f"{ns}server", ns, repo.server_id)
+            if server is None:
+                server = ET.SubElement(servers, f"{ns}server")
+                ET.SubElement(server, f"{ns}id").text = repo.server_id
+            for tag, value in (("username", "aws"), ("password", repo.token)):
+                self.__maven_child__(server, f"{ns}{tag}").text = value
+
+        # A profile per repository with the repository endpoint, active by default
+        profiles = self.__maven_child__(root, f"{ns}profiles")
+        active = self.__maven_child__(root, f"{ns}activeProfiles")
+        for repo in repositories:
+            profile = self.__maven_find__(profiles, f"{ns}profile", ns, repo.server_id)
+            if profile is None:
+                profile = ET.SubElement(profiles, f"{ns}profile")
+                ET.SubElement(profile, f"{ns}id").text = repo.server_id
+            repository_list = self.__maven_child__(profile, f"{ns}repositories")
+            repository = self.__maven_find__(repository_list, f"{ns}repository", ns, repo.server_id)
+            if repository is None:
+                repository = ET.SubElement(repository_list, f"{ns}repository")
+                ET.SubElement(repository, f"{ns}id").text = repo.server_id
+            self.__maven_child__(repository, f"{ns}url").text = repo.endpoint("maven")
+            if repo.server_id not in [element.text for element in active.findall(f"{ns}activeProfile")]:
+                ET.SubElement(active, f"{ns}activeProfile").text = repo.server_id
+        ET.indent(root, space="  ")
+        # ElementTree only keeps what is inside the root element: keep the text around it as it was
+        prolog, epilog = self.__xml_outside__(existing)
+        if not prolog.strip():
+            return ET.tostring(root, encoding="unicode", xml_declaration=True) + "\n" + epilog
+        return f"{prolog.rstrip()}\n{ET.tostring(root, encoding='unicode')}\n{epilog}"
+
+    def __xml_outside__(self, text):
+        """ The text before the root element (declaration, comments) and after its end tag """
+        end = 0
+        while True:
+            match = XML_PROLOG_RE.match(text, end)
+            if not match:
+                break
+            end = match.end()
+        prolog = text[:end]
+        closing = list(XML_ROOT_END_RE.finditer(text))
+        epilog = text[closing[-1].end():].strip() if closing else ""
+        return prolog, f"{epilog}\n" if epilog else ""
+
+    def __maven_child__(self, parent, tag):
+        """ The child element with a tag, created when missing """
+        element = parent.find(tag)
+        if element is None:
+            element = ET.SubElement(parent, tag)
+        return element
+
+    def __maven_find__(self, parent, tag, ns, element_id):
+        """ The child element with a tag and an <id> """
+        for candidate in parent.findall(tag):
+            if candidate.findtext(f"{ns}id") == element_id:
+                return candidate
+        return None
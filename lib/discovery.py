@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import hashlib
+from time import time
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from lib.classes import run_command
+from lib.metrics import write_atomic
+from lib.layered import LayeredConfig, replace_managed_block, strip_managed_block, fragment_files
+from lib.throttle import call_with_retry
+
+BLOCK_BEGIN = "# BEGIN aws-sso-login discovery: {start_url}"
+BLOCK_END = "# END aws-sso-login discovery: {start_url}"
+# Re-list the roles of unchanged accounts after this many seconds
+INDEX_TTL = 24 * 3600
+
+def slug(value):
+    """ Make a config section safe name from an account/role/cluster name """
+    return re.sub(r"[^a-z0-9]+", "-", str(value).lower()).strip("-")
+
+def existing_assignments(aws_config_file, start_url):
+    """ (account id, role name) pairs already configured by hand (in the file or its fragments), outside the discovery block """
+    path = os.path.expanduser(aws_config_file)
+    layers = LayeredConfig(path)
+    # The sections of the file's own discovery block are the discovered profiles, not hand written ones
+    discovered = set()
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            text = f.read()
+        begin, end = BLOCK_BEGIN.format(start_url=start_url), BLOCK_END.format(start_url=start_url)
+        if begin in text and end in text:
+            block = ConfigParser(interpolation=None, strict=False)
+            try:
+                block.read_string(text[text.index(begin):text.index(end)])
+                discovered = set(block.sections())
+            except Exception:
+                pass
+    config = layers.parser
+    return {
+        (config.get(section, "sso_account_id"), config.get(section, "sso_role_name"))
+        for section in config.sections()
+        if config.has_option(section, "sso_account_id") and config.has_option(section, "sso_role_name")
+        and not (section in discovered and layers.source(section)[0] == path)
+    }
+
+class SsoDiscovery:
+    """ Discover the accounts and roles of an SSO start url, keeping an incremental index on disk """
+    def __init__(self, client, start_url, state_dir, region=None, ttl=INDEX_TTL, max_workers=8):
+        self.client = client
+        self.start_url = start_url
+        self.region = region or client.region
+        self.ttl = ttl
+        self.max_workers = max_workers
+        key = hashlib.sha1(start_url.encode("utf-8")).hexdigest()[:12]
+        self.index_file = f"{os.path.expanduser(state_dir)}{os.sep}discovery-{key}.json"
+        self.index = self.__load_index__()
+        self.changed = []
+        # account id -> error of the accounts whose roles or clusters could not be listed
+        self.errors = {}
+        # Profile names and kube contexts configured outside the discovery blocks, never used for discovered ones
+        self.reserved = set()
+        self.reserved_contexts = set()
+
+    def __load_index__(self):
+        try:
+            with open(self.index_file, "r") as f:
+                index = json.load(f)
+            if index.get("start_url") == self.start_url:
+                return index
+        except Exception:
+            pass
+        return {"start_url": self.start_url, "sso_region": self.client.region, "updated": 0, "accounts": {}}
+
+    def __wait_all__(self, futures, wait):
+        while wait and not all(future.done() for future in futures.values()):
+            wait(0.05)
+
+    def refresh(self, access_token, force=False, wait=None):
+        """
+        Refresh the account x role index. Roles are only re-listed for accounts
+        that are new, renamed or older than the ttl. Returns the changed account ids.
+        """
+        now = time()
+        accounts = {account["accountId"]: account for account in self.client.list_accounts(access_token)}
+        cached = self.index["accounts"]
+        stale = [
+            account_id for account_id, account in accounts.items()
+            if force
+            or account_id not in cached
+            or cached[account_id].get("name") != account.get("accountName")
+            or now - cached[account_id].get("updated", 0) > self.ttl
+        ]
+        removed = [account_id for account_id in cached if account_id not in accounts]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                account_id: executor.submit(self.client.list_account_roles, access_token, account_id)
+                for account_id in stale
+            }
+            self.__wait_all__(futures, wait)
+
+        self.changed = list(removed)
+        self.errors = {}
+        for account_id in removed:
+            del cached[account_id]
+        for account_id, future in futures.items():
+            try:
+                roles = sorted(role["roleName"] for role in future.result())
+            except Exception as e:
+                # Keep what the index knew about the account; it is listed again next time
+                self.errors[account_id] = f"Unable to list the roles of account {account_id}: {e}"
+                continue
+            previous = cached.get(account_id, {})
+            if previous.get("roles") != roles or previous.get("name") != accounts[account_id].get("accountName"):
+                self.changed.append(account_id)
+            cached[account_id] = dict(previous, **{
+                "name": accounts[account_id].get("accountName"),
+                "email": accounts[account_id].get("emailAddress"),
+                "roles": roles,
+                "updated": now,
+            })
+        self.index["updated"] = now
+        self.save()
+        return self.changed
+
+    def save(self):
+        write_atomic(self.index_file, json.dumps(self.index, indent=2, sort_keys=True))
+
+    def profile_name(self, account_id, role_name):
+        account = self.index["accounts"][account_id]
+        return f"{slug(account.get('name') or account_id)}-{slug(role_name)}"
+
+    def __unique__(self, names, taken):
+        """
+        {key: unique name} for {key: (account id, name)}: names that collide with each other or with
+        `taken` get the account id appended (and a counter, if that still collides)
+        """
+        counts = {}
+        for account_id, name in names.values():
+            counts[name] = counts.get(name, 0) + 1
+        unique = {}
+        used = set(taken)
+        for key, (account_id, name) in names.items():
+            if counts[name] > 1 or name in used:
+                name = f"{name}-{account_id}"
+                base, idx = name, 2
+                while name in used:
+                    name, idx = f"{base}-{idx}", idx + 1
+            used.add(name)
+            unique[key] = name
+        return unique
+
+    def __reserved_names__(self, config_file):
+        """ The section (profile) names of a config file (outside this start url's block) and its fragments """
+        path = os.path.expanduser(config_file)
+        names = set()
+        for config_file in fragment_files(path) + [path]:
+            if not os.path.isfile(config_file):
+                continue
+            with open(config_file, "r") as f:
+                text = strip_managed_block(f.read(), BLOCK_BEGIN.format(start_url=self.start_url), BLOCK_END.format(start_url=self.start_url))
+            config = ConfigParser(interpolation=None, strict=False)
+            try:
+                config.read_string(text)
+            except Exception:
+                continue
+            names.update(section[8:] if section.startswith("profile ") else section for section in config.sections())
+        return names
+
+    def profiles(self, skip=None):
+        """
+        Return {profile name: (account id, role name)} for the index, minus the (account, role) pairs in `skip`.
+        Names are unique, also against the hand written profiles (`reserved`).
+        """
+        skip = skip or set()
+        names = {}
+        for account_id, account in sorted(self.index["accounts"].items(), key=lambda item: item[1].get("name") or item[0]):
+            for role_name in account.get("roles", []):
+                if (account_id, role_name) not in skip:
+                    names[(account_id, role_name)] = (account_id, self.profile_name(account_id, role_name))
+        return {name: assignment for assignment, name in self.__unique__(names, self.reserved).items()}
+
+    def render_profiles(self, skip=None):
+        """ Render the discovered profiles as aws config sections """
+        lines = []
+        for name, (account_id, role_name) in self.profiles(skip).items():
+            lines.extend([
+                f"[profile {name}]",
+                f"sso_start_url = {self.start_url}",
+                f"sso_region = {self.index['sso_region']}",
+                f"sso_account_id = {account_id}",
+                f"sso_role_name = {role_name}",
+                f"region = {self.region}",
+                "output = json",
+                "",
+            ])
+        return "\n".join(lines)
+
+    def write_profiles(self, aws_config_file, skip=None):
+        """ Write the discovered profiles into the managed block of the aws config file """
+        self.reserved = self.__reserved_names__(aws_config_file)
+        return replace_managed_block(
+            os.path.expanduser(aws_config_file),
+            BLOCK_BEGIN.format(start_url=self.start_url),
+            BLOCK_END.format(start_url=self.start_url),
+            self.render_profiles(skip)
+        )
+
+    def refresh_clusters(self, awscli, limiter, retry_policy, retry_stats=None, wait=None, skip=None):
+        """ List the EKS clusters of changed (or never listed) accounts using one discovered profile per account """
+        todo = {}
+        for name, (account_id, role_name) in self.profiles(skip).items():
+            account = self.index["accounts"][account_id]
+            if account_id in todo or (account_id not in self.changed and "clusters" in account):
+                continue
+            todo[account_id] = name
+
+        def list_clusters(profile_name):
+            # stdout only: a cli warning on stderr must not break the json
+            exit_code, output = call_with_retry(
+                lambda: run_command(awscli, [
+                    "--profile", profile_name, "--region", self.region,
+                    "eks", "list-clusters", "--output", "json", "--no-cli-pager"
+                ], merge_stderr=False),
+                "eks", self.region, limiter, retry_policy, retry_stats
+            )
+            if exit_code != 0:
+                raise RuntimeError(output.strip().splitlines()[-1] if output.strip() else f"exit code {exit_code}")
+            return sorted(json.loads(output).get("clusters", []))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {account_id: executor.submit(list_clusters, name) for account_id, name in todo.items()}
+            self.__wait_all__(futures, wait)
+        for account_id, future in futures.items():
+            try:
+                clusters = future.result()
+            except Exception as e:
+                self.errors[account_id] = f"Unable to list the EKS clusters of account {account_id}: {e}"
+                continue
+            self.index["accounts"][account_id]["clusters"] = clusters
+            self.index["accounts"][account_id]["cluster_profile"] = todo[account_id]
+        self.save()
+        return len(futures)
+
+    def render_clusters(self):
+        """ Render the discovered EKS clusters as eks_auth sections """
+        names = {}
+        for account_id, account in sorted(self.index["accounts"].items(), key=lambda item: item[1].get("name") or item[0]):
+            for cluster in account.get("clusters", []):
+                names[(account_id, cluster)] = (account_id, f"{slug(account.get('name') or account_id)}-{slug(cluster)}")
+        lines = []
+        for (account_id, cluster), name in self.__unique__(names, self.reserved_contexts).items():
+            account = self.index["accounts"][account_id]
+            lines.extend([
+                f"[{name}]",
+                "ENABLE=true",
+                f"EKS_CLUSTER={cluster}",
+                f"AWS_PROFILE={account['cluster_profile']}",
+                f"AWS_REGION={self.region}",
+                "",
+            ])
+        return "\n".join(lines)
+
+    def write_clusters(self, eks_config_file):
+        """ Write the discovered clusters into the managed block of the eks_auth file """
+        self.reserved_contexts = self.__reserved_names__(eks_config_file)
+        return replace_managed_block(
+            os.path.expanduser(eks_config_file),
+            BLOCK_BEGIN.format(start_url=self.start_url),
+            BLOCK_END.format(start_url=self.start_url),
+            self.render_clusters()
+        )
@@ -0,0 +1,185 @@
+import os
+import json
+import base64
+import shutil
+import socket
+import hashlib
+import platform
+import threading
+from time import time
+from pathlib import Path
+from urllib.parse import urlparse
+from lib.classes import run_command
+from lib.metrics import write_atomic
+
+PING_REQUEST = b"GET /_ping HTTP/1.1\r\nHost: docker\r\nUser-Agent: aws-sso-login\r\nConnection: close\r\n\r\n"
+# Seconds a probe result is reused
+CACHE_TTL = 10
+_cache = {}
+_lock = threading.Lock()
+
+def docker_config_dir():
+    return os.environ.get("DOCKER_CONFIG") or f"{Path.home()}{os.sep}.docker"
+
+def docker_host():
+    """ Resolve the docker daemon address from DOCKER_HOST, the current docker context or the platform default """
+    if os.environ.get("DOCKER_HOST"):
+        return os.environ["DOCKER_HOST"]
+
+    context = os.environ.get("DOCKER_CONTEXT")
+    if not context:
+        try:
+            with open(f"{docker_config_dir()}{os.sep}config.json", "r") as f:
+                context = json.load(f).get("currentContext")
+        except Exception:
+            context = None
+    if context and context != "default":
+        meta_dir = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        meta_file = f"{docker_config_dir()}{os.sep}contexts{os.sep}meta{os.sep}{meta_dir}{os.sep}meta.json"
+        try:
+            with open(meta_file, "r") as f:
+                host = json.load(f)["Endpoints"]["docker"]["Host"]
+            if host:
+                return host
+        except Exception:
+            pass
+
+    if platform.system().lower() == "windows":
+        return "npipe:////./pipe/docker_engine"
+    return "unix:///var/run/docker.sock"
+
+def __is_ok__(response):
+    status = response.split(b"\r\n", 1)[0]
+    return b" 200 " in status or status.endswith(b" 200")
+
+def __connect_unix__(path, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def __ping_socket__(connect, timeout):
+    """ Ping over a unix or tcp socket. None when the socket cannot be reached. """
+    try:
+        sock = connect()
+    except OSError:
+        return None
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.sendall(PING_REQUEST)
+            response = b""
+            while b"\r\n" not in response:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    break
+                response += chunk
+        except OSError:
+            # Connected, but the daemon did not answer in time (e.g. still starting)
+            return False
+        return __is_ok__(response)
+    finally:
+        sock.close()
+
+def __ping_npipe__(path, timeout):
+    """ Ping over a Windows named pipe. None when the pipe does not exist. """
+    result = {}
+
+    def ping():
+        try:
+            with open(path, "r+b", buffering=0) as pipe:
+                pipe.write(PING_REQUEST)
+                result["response"] = pipe.read(1024)
+        except FileNotFoundError:
+            result["missing"] = True
+        except OSError:
+            result["response"] = b""
+
+    thread = threading.Thread(target=ping, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if result.get("missing"):
+        return None
+    if "response" not in result:
+        return False
+    return __is_ok__(result["response"])
+
+def docker_ping(host=None, timeout=1.0, use_cache=True):
+    """
+    Check the docker daemon with GET /_ping on its API socket.
+    Returns True (alive), False (reachable but not answering OK) or None when no
+    socket could be reached/used (for example ssh:// or TLS hosts), so the caller
+    can fall back to the docker cli.
+    """
+    host = host or docker_host()
+    with _lock:
+        cached = _cache.get(host)
+        if use_cache and cached and time() - cached[1] < CACHE_TTL:
+            return cached[0]
+
+    url = urlparse(host)
+    if url.scheme == "unix":
+        result = __ping_socket__(lambda: __connect_unix__(url.path, timeout), timeout) if hasattr(socket, "AF_UNIX") else None
+    elif url.scheme == "npipe":
+        result = __ping_npipe__(url.path.replace("/", "\\"), timeout)
+    elif url.scheme in ("tcp", "http") and not os.environ.get("DOCKER_TLS_VERIFY"):
+        result = __ping_socket__(lambda: socket.create_connection((url.hostname, url.port or 2375), timeout), timeout)
+    else:
+        result = None
+
+    with _lock:
+        _cache[host] = (result, time())
+    return result
+
+def docker_login_batch(registries, username="AWS", config_dir=None):
+    """
+    Store the credentials of several registries with a single docker config update, the way
+    `docker login` stores them: in the registry's credential helper (credHelpers/credsStore) when
+    one is configured, otherwise base64 encoded in `auths`.
+    Returns {registry: error} for the registries that could not be stored, so the caller can
+    fall back to `docker login` for them.
+    """
+    config_dir = config_dir or docker_config_dir()
+    config_file = f"{config_dir}{os.sep}config.json"
+    config = {}
+    if os.path.isfile(config_file):
+        try:
+            with open(config_file, "r") as f:
+                config = json.load(f)
+        except Exception as e:
+            return {registry: f"Unable to read {config_file}: {e}" for registry in registries}
+
+    failed = {}
+    auths = config.setdefault("auths", {})
+    for registry, password in registries.items():
+        helper = (config.get("credHelpers") or {}).get(registry) or config.get("credsStore")
+        if not helper:
+            auth = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+            auths[registry] = {"auth": auth}
+            continue
+        if helper == "ecr-login":
+            # amazon-ecr-credential-helper gets its own tokens; there is nothing to store
+            continue
+        helper_bin = shutil.which(f"docker-credential-{helper}")
+        if not helper_bin:
+            failed[registry] = f"Credential helper docker-credential-{helper} not found"
+            continue
+        exit_code, output = run_command(
+            helper_bin, ["store"], input=json.dumps({"ServerURL": registry, "Username": username, "Secret": password}), timeout=30
+        )
+        if exit_code != 0:
+            failed[registry] = output.strip() or f"docker-credential-{helper} store failed"
+            continue
+        # docker login keeps an empty entry for registries stored in a helper
+        auths[registry] = {}
+
+    if len(failed) < len(registries):
+        try:
+            write_atomic(config_file, json.dumps(config, indent="\t"))
+        except Exception as e:
+            return {registry: f"Unable to write {config_file}: {e}" for registry in registries}
+    return failed
@@ -0,0 +1,612 @@
+import os
+import shlex
+import asyncio
+import threading
+from time import time, sleep
+from lib.classes import AwsProfile, EnvCodeArtifactToken
+from lib.throttle import RateLimiter, RetryPolicy, RetryStats, THROTTLE
+from lib.pipeline import (
+    sso_login_args, ecr_login_password_args, ecr_regions, ecr_registries, eks_region, eks_update_kubeconfig_args,
+    codeartifact_token_args, codeartifact_endpoint_args
+)
+from lib.schedule import MAX_WORKERS
+from lib.sso import SsoClient, SsoError, parse_timestamp
+from lib.chain import RoleChain
+from lib.docker import docker_login_batch
+from lib.kubeshards import KubeShards
+from lib.codeartifact import CodeArtifactRepository, EndpointCache, PackageManagerConfig, TOOL_FORMATS, parse_tools
+
+# The steps of a run, in the order they run
+STEPS = ("login", "ecr", "eks", "codeartifact")
+# A single aws cli command (the sso login fallback waits for the browser, so it gets longer)
+CLI_TIMEOUT = 300
+LOGIN_TIMEOUT = 900
+
+# Event statuses
+STARTED = "started"      # a step started
+DONE = "done"            # a step finished
+INFO = "info"            # output worth showing
+PROMPT = "prompt"        # the SSO device authorization needs the user: data has url and user_code
+RETRY = "retry"          # a throttled or failed call is retried
+PROGRESS = "progress"    # a job of a step finished (for the estimate only)
+OK = "ok"                # a job finished
+FAILED = "failed"        # a job failed
+SKIPPED = "skipped"      # a job was not needed
+CANCELLED = "cancelled"  # the run was cancelled
+
+class RunCancelled(Exception):
+    pass
+
+class Event:
+    """
+    A progress event of a run. `step` is the metrics step (login, sts, ecr, eks, codeartifact),
+    `key` the job in the run estimate (None when the event does not complete a planned job),
+    `profile` the profile (or kube context) it is about and `data` any structured result.
+    """
+    def __init__(self, step, status, message="", profile=None, key=None, seconds=None, data=None):
+        self.step = step
+        self.status = status
+        self.message = message
+        self.profile = profile
+        self.key = key
+        self.seconds = seconds
+        self.data = data or {}
+
+    def as_dict(self):
+        return {
+            "step": self.step, "status": self.status, "message": self.message, "profile": self.profile,
+            "key": self.key, "seconds": self.seconds, "data": self.data
+        }
+
+    def __repr__(self):
+        return f"Event({self.step}, {self.status}, {self.profile or '-'}: {self.message})"
+
+def __kill__(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+async def run_command_async(command, args, env=None, input=None, timeout=None, merge_stderr=True, on_line=None):
+    """
+    asyncio version of run_command: run a command to completion and return (exit code, output).
+    With `on_line` every output line is passed to it as it is read. The process is killed on
+    timeout or when the calling task is cancelled.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            command, *args,
+            env=env,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        return 1, str(e)
+
+    async def communicate():
+        if not on_line:
+            return await process.communicate(input.encode("utf8") if input is not None else None)
+        if input is not None:
+            process.stdin.write(input.encode("utf8"))
+            process.stdin.close()
+        lines = []
+        async for line in process.stdout:
+            line = line.decode("utf8", errors="replace")
+            lines.append(line)
+            on_line(line.rstrip())
+        stderr = await process.stderr.read() if process.stderr else b""
+        await process.wait()
+        return "".join(lines).encode("utf8"), stderr
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        __kill__(process)
+        # Drain the pipes too, so their transports are closed with the event loop still running
+        await process.communicate()
+        # Not "Read timeout" (a transient aws cli error): the retry policy must not retry our own timeout
+        return 1, f"Command timed out after {timeout}s: {shlex.quote(command)}"
+    except asyncio.CancelledError:
+        __kill__(process)
+        await process.communicate()
+        raise
+    output = stdout.decode("utf8", errors="replace")
+    if merge_stderr or process.returncode == 0:
+        return process.returncode, output
+    return process.returncode, f"{output}{(stderr or b'').decode('utf8', errors='replace')}"
+
+def __last_line__(output):
+    return output.strip().splitlines()[-1] if output.strip() else "unknown"
+
+class Engine:
+    """
+    The login pipeline (SSO login and chained roles, ECR, EKS, CodeArtifact) without a UI.
+    Takes the profiles and clusters of an `Initialize` and yields `Event`s from `run()`:
+
+        engine = Engine(Initialize(ARGUMENTS), max_concurrency=8, timeout=120)
+        async for event in engine.run(["login", "ecr"]):
+            print(event.as_dict())
+
+    At most `max_concurrency` aws/docker commands run at a time, each killed after `timeout`
+    seconds. The run stops when `cancel` (a threading.Event) is set or its task is cancelled.
+    """
+    def __init__(self, args, profiles=None, limiter=None, retry_policy=None, retry_stats=None, history=None, prefetch=None,
+                 max_concurrency=MAX_WORKERS, timeout=CLI_TIMEOUT, login_timeout=LOGIN_TIMEOUT, cancel=None):
+        self.args = args
+        self.awscli = args.arguments["cmd"]["awscli"].value
+        self.docker = args.arguments["cmd"]["docker"].value
+        # Selected profiles (default: all of them)
+        self.selected = list(args.profiles.values()) if profiles is None else list(profiles)
+        self.limiter = limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_stats = retry_stats or RetryStats()
+        self.history = history
+        self.prefetch = prefetch
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.login_timeout = login_timeout
+        self.cancel = cancel
+        # Set when the run stops, so work on threads stops waiting too
+        self.stopping = threading.Event()
+        self.loop = None
+        self.queue = None
+        self.semaphore = None
+
+    # Profile and cluster selection
+    def login_profiles(self):
+        """ Selected profiles that can login to AWS SSO, plus the SSO profiles the selected role chains start at """
+        profiles = self.sso_profiles()
+        for profile in self.chained_profiles():
+            if profile.root.sso_role_name and profile.root not in profiles:
+                profiles.append(profile.root)
+        return profiles
+
+    def sso_profiles(self):
+        """ Selected profiles that can login to AWS SSO """
+        return [p for p in self.selected if p.sso_start_url and p.enabled and p.sso_role_name]
+
+    def chained_profiles(self):
+        """ Selected profiles that assume a role through source_profile """
+        return [p for p in self.selected if p.is_chained and p.enabled]
+
+    def run_profiles(self):
+        """ Selected SSO and chained profiles (not the unselected SSO profiles their chains start at) """
+        return self.sso_profiles() + self.chained_profiles()
+
+    def ecr_profiles(self):
+        """ Selected profiles with an account id, for ECR """
+        return [p for p in self.run_profiles() if p.account_id]
+
+    def ecr_jobs(self):
+        """
+        The ECR tokens a run needs: {f"{profile}@{region}": (profile, region, registries)}, one per
+        profile and region that covers a registry no earlier profile covers. A token covers every
+        registry of its region the role can access, so a registry shared by profiles is fetched once.
+        """
+        jobs = {}
+        planned = set()
+        for profile in self.ecr_profiles():
+            for region in ecr_regions(profile):
+                registries = [registry for registry in ecr_registries(profile, region) if registry not in planned]
+                if registries:
+                    planned.update(registries)
+                    jobs[f"{profile.name}@{region}"] = (profile, region, registries)
+        return jobs
+
+    def eks_configs(self):
+        """ Enabled EKS clusters whose profile is known and selected """
+        names = set(p.name for p in self.selected)
+        return [
+            kubeconfig for kubeconfig in self.args.kube_configs.values()
+            if kubeconfig.enable and isinstance(kubeconfig.aws_profile, AwsProfile) and kubeconfig.aws_profile.name in names
+        ]
+
+    def cart_domains(self):
+        """ Selected profiles with a CodeArtifact domain, grouped by (domain, owner, region) """
+        domains = {}
+        for profile in self.selected:
+            if profile.code_artifact_domain:
+                domains.setdefault((profile.code_artifact_domain, profile.account_id, profile.region), []).append(profile)
+        return domains
+
+    def plan(self, steps=STEPS):
+        """ {service: job keys} of the run, for a RunEstimate """
+        plan = {}
+        if "login" in steps:
+            plan["login"] = [p.name for p in self.login_profiles()]
+            plan["sts"] = [p.name for p in self.chained_profiles()]
+        if "ecr" in steps:
+            plan["ecr"] = list(self.ecr_jobs())
+        if "eks" in steps:
+            plan["eks"] = [k.context for k in self.eks_configs()]
+        if "codeartifact" in steps:
+            plan["codeartifact"] = [profiles[0].name for profiles in self.cart_domains().values()]
+        return plan
+
+    # Running
+    async def run(self, steps=STEPS):
+        """ Run the steps, yielding their events as they happen """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.stopping.clear()
+        worker = asyncio.ensure_future(self.__run__([step for step in STEPS if step in steps]))
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), 0.1)
+                except asyncio.TimeoutError:
+                    if self.cancel and self.cancel.is_set() and not worker.done():
+                        self.stopping.set()
+                        worker.cancel()
+                    continue
+                if event is None:
+                    break
+                yield event
+        finally:
+            self.stopping.set()
+            if not worker.done():
+                worker.cancel()
+                try:
+                    await worker
+                except asyncio.CancelledError:
+                    pass
+
+    async def __run__(self, steps):
+        try:
+            for step in steps:
+                await getattr(self, f"__{step}__")()
+        except asyncio.CancelledError:
+            self.__emit__(Event("run", CANCELLED, "Run cancelled."))
+        except Exception as e:
+            self.__emit__(Event("run", FAILED, f"[ERROR] Run failed: {e}"))
+        finally:
+            self.__emit__(None)
+
+    def __emit__(self, event):
+        """ Queue an event (from the event loop or a worker thread) """
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def __thread_wait__(self, seconds):
+        """ `wait` for blocking calls on worker threads: sleeps, but gives up when the run stops """
+        deadline = time() + seconds
+        while time() < deadline:
+            if self.stopping.is_set():
+                raise RunCancelled()
+            sleep(min(0.05, max(0, deadline - time())))
+
+    def __order__(self, service, keys):
+        return self.history.order(service, keys) if self.history else keys
+
+    async def __aws__(self, service, region, args, profile=None, env=None, merge_stderr=False, timeout=None, on_line=None):
+        """ Run an aws cli command, rate limited per service/region and retried on throttling or transient errors """
+        attempt = 0
+        while True:
+            attempt += 1
+            delay = self.limiter.reserve(service, region)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.retry_stats.record_call(service)
+            async with self.semaphore:
+                exit_code, output = await run_command_async(
+                    self.awscli, args, env=env, merge_stderr=merge_stderr, timeout=timeout or self.timeout, on_line=on_line
+                )
+            kind = self.retry_policy.classify(exit_code, output)
+            if exit_code == 0 or not self.retry_policy.should_retry(kind, attempt):
+                if exit_code != 0:
+                    self.retry_stats.record_failure(service)
+                return exit_code, output
+            delay = self.retry_policy.backoff(attempt)
+            self.retry_stats.record_retry(service, kind)
+            label = "Throttled" if kind == THROTTLE else "Transient error"
+            self.__emit__(Event(
+                service, RETRY, f"{label} calling {service} in {region}. Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.retry_policy.max_attempts})",
+                profile=profile.name if profile else None
+            ))
+            await asyncio.sleep(delay)
+
+    # SSO login and chained roles
+    async def __login__(self):
+        self.__emit__(Event("login", STARTED, "Begin AWS SSO Login. Please wait..."))
+        for profile in self.selected:
+            if not profile.is_chained and not profile.sso_start_url:
+                self.__emit__(Event("login", INFO, "SSO Start URL not found. Skipping...", profile=profile.name))
+        groups = {}
+        for profile in self.login_profiles():
+            groups.setdefault((profile.sso_start_url, profile.sso_region or profile.region), []).append(profile)
+
+        for (start_url, region), profiles in groups.items():
+            self.__emit__(Event("login", INFO, f"Logging into AWS SSO: {start_url} ({len(profiles)} profiles)"))
+            # Submit the slowest profiles first
+            rank = {name: idx for idx, name in enumerate(self.__order__("login", [profile.name for profile in profiles]))}
+            profiles = sorted(profiles, key=lambda profile: rank[profile.name])
+            started = time()
+            durations = {}
+            try:
+                results = await asyncio.to_thread(self.__role_credentials__, start_url, region, profiles, durations)
+            except RunCancelled:
+                raise asyncio.CancelledError()
+            except Exception as e:
+                self.__emit__(Event("login", INFO, f"[WARNING] In-process SSO login failed: {e}. Falling back to aws cli."))
+                for profile in profiles:
+                    await self.__sso_login_cli__(profile)
+                continue
+
+            elapsed = time() - started
+            if self.prefetch:
+                self.prefetch.invalidate_session(start_url)
+            for profile in profiles:
+                result = results[profile.name]
+                seconds = durations.get(profile.name, elapsed)
+                if isinstance(result, Exception):
+                    self.__emit__(Event("login", FAILED, f"Failed to get role credentials. Reason: {result}", profile.name, profile.name, seconds))
+                else:
+                    self.__emit__(Event(
+                        "login", OK, f"Role credentials valid until {result['Expiration']}", profile.name, profile.name, seconds,
+                        {"credential": "sso_role", "expires": parse_timestamp(result["Expiration"])}
+                    ))
+        self.__emit__(Event("login", DONE, "AWS SSO Login Completed."))
+        if self.chained_profiles():
+            await self.__assume_roles__()
+
+    def __role_credentials__(self, start_url, region, profiles, durations):
+        """ Device login once for the start url and fetch the role credentials of its profiles (runs on a worker thread) """
+        client = SsoClient(region, limiter=self.limiter, retry_policy=self.retry_policy, retry_stats=self.retry_stats)
+        on_prompt = lambda url, user_code: self.__emit__(Event("login", PROMPT, "", data={"url": url, "user_code": user_code}))
+        access_token = client.device_login(start_url, on_prompt=on_prompt, wait=self.__thread_wait__)
+        results = client.fetch_role_credentials(
+            access_token, start_url, profiles, max_workers=self.max_concurrency, wait=self.__thread_wait__, durations=durations
+        )
+        # A cached token can be revoked server side. Login again once and retry the failed profiles.
+        expired = [p for p in profiles if isinstance(results[p.name], SsoError) and results[p.name].status == 401]
+        if expired:
+            access_token = client.device_login(start_url, on_prompt=on_prompt, wait=self.__thread_wait__, force=True)
+            results.update(client.fetch_role_credentials(
+                access_token, start_url, expired, max_workers=self.max_concurrency, force=True, wait=self.__thread_wait__
+            ))
+        return results
+
+    async def __sso_login_cli__(self, profile):
+        """ Login to AWS SSO for a single profile using `aws sso login`, streaming its output (the verification url) """
+        self.__emit__(Event("login", INFO, f"Logging into AWS SSO for profile: {profile.name}"))
+        started = time()
+        exit_code, output = await self.__aws__(
+            "sso", profile.region, sso_login_args(profile), profile, merge_stderr=True, timeout=self.login_timeout,
+            on_line=lambda line: line and self.__emit__(Event("login", INFO, line, profile=profile.name))
+        )
+        if exit_code == 0 and self.prefetch:
+            self.prefetch.invalidate_session(profile.sso_start_url)
+        status = OK if exit_code == 0 else FAILED
+        message = "AWS SSO Login Completed." if exit_code == 0 else f"AWS SSO Login Failed. Reason: {__last_line__(output)}"
+        self.__emit__(Event("login", status, message, profile.name, profile.name, time() - started))
+
+    async def __assume_roles__(self):
+        """ Assume the roles of the chained profiles, each shared hop once """
+        profiles = self.chained_profiles()
+        self.__emit__(Event("sts", STARTED, f"Assuming chained roles ({len(profiles)} profiles). Please wait..."))
+        chain = RoleChain(
+            self.awscli, self.limiter, self.retry_policy, self.retry_stats, max_workers=self.max_concurrency, timeout=self.timeout
+        )
+        durations = {}
+        try:
+            results = await asyncio.to_thread(chain.resolve, profiles, self.__thread_wait__, durations)
+        except RunCancelled:
+            raise asyncio.CancelledError()
+        for profile in profiles:
+            result = results[profile.name]
+            seconds = durations.get(profile.name, 0)
+            if isinstance(result, Exception):
+                self.__emit__(Event("sts", FAILED, f"Failed to assume role. Reason: {result}", profile.name, profile.name, seconds))
+            else:
+                self.__emit__(Event(
+                    "sts", OK, f"Role credentials valid until {result['Expiration']}", profile.name, profile.name, seconds,
+                    {"credential": "assumed_role", "expires": parse_timestamp(result["Expiration"])}
+                ))
+        self.__emit__(Event("sts", DONE, f"Chained roles completed: {chain.assumed} AssumeRole call(s)."))
+
+    # ECR
+    async def __ecr__(self):
+        self.__emit__(Event("ecr", STARTED, "Begin ECR Login. Please wait..."))
+        for profile in self.run_profiles():
+            if not profile.account_id:
+                self.__emit__(Event("ecr", INFO, f"Profile [{profile.name}] does not have a valid Account ID. Skipping..."))
+        jobs = self.ecr_jobs()
+        # Fetch the ECR passwords of every needed profile and region concurrently, longest-expected-first
+        keys = self.__order__("ecr", list(jobs))
+        tokens = await asyncio.gather(*[self.__ecr_password__(key, *jobs[key][:2]) for key in keys])
+        results = dict(zip(keys, tokens))
+
+        # Then login to all the registries of a profile as one batch
+        for profile in self.ecr_profiles():
+            own = [key for key, job in jobs.items() if job[0] is profile]
+            if not own:
+                self.__emit__(Event("ecr", SKIPPED, "ECR registries already logged in by another profile. Skipping...", profile.name, seconds=0))
+                continue
+            registries = {}
+            elapsed = 0.0
+            for key in own:
+                _, region, job_registries = jobs[key]
+                (exit_code, output), seconds = results[key]
+                elapsed = max(elapsed, seconds)
+                if exit_code != 0 or not output.strip():
+                    self.__emit__(Event(
+                        "ecr", INFO, f"Failed to get ECR password for {region}. Check AWS CLI configuration. Reason: {__last_line__(output)}",
+                        profile=profile.name
+                    ))
+                    continue
+                registries.update((registry, output.strip()) for registry in job_registries)
+            if not registries:
+                self.__emit__(Event("ecr", FAILED, "No ECR password could be fetched.", profile.name, seconds=elapsed))
+                continue
+            started = time()
+            profile.ecr_password = next(iter(registries.values()))
+            failed = await self.__docker_login__(registries)
+            for registry, error in failed.items():
+                self.__emit__(Event("ecr", INFO, f"Docker login to {registry} failed. Reason: {error}", profile=profile.name))
+            count = len(registries) - len(failed)
+            seconds = elapsed + time() - started
+            if count:
+                self.__emit__(Event(
+                    "ecr", OK, f"Logged in to {count} ECR registr{'y' if count == 1 else 'ies'}.", profile.name, seconds=seconds,
+                    data={"credential": "ecr", "registries": [registry for registry in registries if registry not in failed]}
+                ))
+            else:
+                self.__emit__(Event("ecr", FAILED, "Docker login failed.", profile.name, seconds=seconds))
+        self.__emit__(Event("ecr", DONE, "AWS ECR Login Completed."))
+
+    async def __ecr_password__(self, key, profile, region):
+        """ The ECR password of a profile in a region (prefetched when possible). Returns ((exit code, output), seconds). """
+        started = time()
+        result = None
+        if self.prefetch:
+            result = await asyncio.to_thread(self.prefetch.ecr_password, profile.name, region)
+        if not result:
+            result = await self.__aws__("ecr", region, ecr_login_password_args(profile, region), profile)
+        seconds = time() - started
+        self.__emit__(Event("ecr", PROGRESS, key=key, seconds=seconds))
+        return result, seconds
+
+    async def __docker_login__(self, registries):
+        """
+        Login to {registry: password} with one docker config update, falling back to `docker login`
+        for registries that could not be stored that way. Returns {registry: error} of the failed ones.
+        """
+        failed = await asyncio.to_thread(docker_login_batch, registries)
+        for registry in list(failed):
+            async with self.semaphore:
+                exit_code, output = await run_command_async(
+                    self.docker, ["--log-level", "error", "login", "--username", "AWS", "--password-stdin", registry],
+                    input=registries[registry], timeout=self.timeout
+                )
+            if exit_code == 0:
+                del failed[registry]
+            else:
+                failed[registry] = __last_line__(output)
+        return failed
+
+    # EKS
+    async def __eks__(self):
+        self.__emit__(Event("eks", STARTED, "Begin kubectl Authorization. Please wait..."))
+        shard_dir = self.args.arguments["config"]["kube_shards"].value
+        if shard_dir:
+            os.makedirs(os.path.expanduser(shard_dir), exist_ok=True)
+        # Clusters sharing a kubeconfig file are updated one at a time; separate files concurrently
+        # Longest-expected-first: the clusters in history order, so each file starts with its slowest
+        # cluster and the file holding the slowest cluster starts first
+        configs = {kubeconfig.context: kubeconfig for kubeconfig in self.eks_configs()}
+        files = {}
+        for context in self.__order__("eks", list(configs)):
+            kubeconfig = configs[context]
+            files.setdefault(os.path.expanduser(kubeconfig.kube_config), []).append(kubeconfig)
+        await asyncio.gather(*[self.__eks_file__(kubeconfigs) for kubeconfigs in files.values()])
+        if shard_dir:
+            shards = KubeShards(shard_dir)
+            try:
+                for path in shards.sync(self.args.kube_configs):
+                    self.__emit__(Event("eks", INFO, f"Removed kubeconfig of a cluster no longer in the EKS config: {path}"))
+                self.__emit__(Event("eks", INFO, f"Per-context kubeconfigs in: {shards.shard_dir} (source {shards.env_file} to use all of them)"))
+            except Exception as e:
+                self.__emit__(Event("eks", INFO, f"[WARNING] Unable to update the kubeconfig index: {e}"))
+        self.__emit__(Event("eks", DONE, "AWS EKS Authorization Completed."))
+
+    async def __eks_file__(self, kubeconfigs):
+        for kubeconfig in kubeconfigs:
+            name = kubeconfig.context
+            started = time()
+            if await self.__prefetched_kubeconfig__(name):
+                self.__emit__(Event("eks", SKIPPED, "Kubeconfig is up to date. Skipping...", name, name, time() - started))
+                continue
+            exit_code, output = await self.__aws__(
+                "eks", eks_region(kubeconfig), eks_update_kubeconfig_args(kubeconfig), kubeconfig.aws_profile, merge_stderr=True
+            )
+            if exit_code == 0:
+                self.__emit__(Event("eks", OK, output.strip(), name, name, time() - started))
+            else:
+                self.__emit__(Event("eks", FAILED, f"Process Failed. Reason: {__last_line__(output)}", name, name, time() - started))
+
+    async def __prefetched_kubeconfig__(self, context):
+        """ True when the prefetch found the cluster's kubeconfig entry already up to date """
+        if not self.prefetch:
+            return False
+        while self.prefetch.pending("eks", context):
+            await asyncio.sleep(0.05)
+        return self.prefetch.kubeconfig_current(context)
+
+    # CodeArtifact
+    async def __codeartifact__(self):
+        self.__emit__(Event("codeartifact", STARTED, "Begin AWS CodeArtifact Authorization Token. Please wait..."))
+        endpoint_cache = EndpointCache(self.args.arguments["config"]["state"].value)
+        repositories = []
+        # One token per domain, even when several profiles use the same domain
+        for (domain, owner, region), profiles in self.cart_domains().items():
+            profile = profiles[0]
+            started = time()
+            exit_code, output = await self.__aws__("codeartifact", region, codeartifact_token_args(profile, domain, owner, region), profile)
+            token = output.strip()
+            if exit_code != 0 or not token:
+                self.__emit__(Event("codeartifact", FAILED, f"Process Failed. Reason: {__last_line__(output)}", profile.name, profile.name, time() - started))
+                continue
+            self.__emit__(Event(
+                "codeartifact", OK, "", profile.name, profile.name, time() - started,
+                {"credential": "codeartifact", "profiles": [p.name for p in profiles], "domain": domain, "token": token}
+            ))
+            env_update = EnvCodeArtifactToken(token, domain, profile.code_artifact_env_file)
+            if env_update.written:
+                self.__emit__(Event("codeartifact", INFO, f"CodeArtifact Token Environment Variables Updated in user profile. File: {env_update.shell_rc}"))
+
+            # Resolve the repository endpoints for the package manager configuration
+            for repo_profile in profiles:
+                if not repo_profile.code_artifact_repository:
+                    continue
+                tools = parse_tools(repo_profile.code_artifact_tools)
+                endpoints = {}
+                for fmt in sorted(set(TOOL_FORMATS[tool] for tool in tools)):
+                    endpoint = await self.__codeartifact_endpoint__(repo_profile, fmt, endpoint_cache)
+                    if endpoint:
+                        endpoints[fmt] = endpoint
+                repositories.append(CodeArtifactRepository(
+                    domain, owner, repo_profile.code_artifact_repository, token, endpoints, tools,
+                    primary=not repositories
+                ))
+
+        if repositories:
+            try:
+                endpoint_cache.save()
+                for config_file in PackageManagerConfig(repositories).write():
+                    self.__emit__(Event("codeartifact", INFO, f"CodeArtifact repository configured in: {config_file}"))
+            except Exception as e:
+                self.__emit__(Event("codeartifact", INFO, f"[ERROR] Unable to write package manager configuration: {e}"))
+        self.__emit__(Event("codeartifact", DONE, "AWS CodeArtifact Authorization Token Completed."))
+
+    async def __codeartifact_endpoint__(self, profile, fmt, endpoint_cache):
+        """ Look up (and cache) the endpoint of a CodeArtifact repository for a package format """
+        endpoint = endpoint_cache.get(profile.code_artifact_domain, profile.account_id, profile.code_artifact_repository, fmt)
+        if endpoint:
+            return endpoint
+        exit_code, output = await self.__aws__("codeartifact", profile.region, codeartifact_endpoint_args(profile, fmt), profile)
+        if exit_code != 0 or not output.strip():
+            self.__emit__(Event("codeartifact", INFO, f"Unable to get the {fmt} endpoint. Reason: {__last_line__(output)}", profile=profile.name))
+            return None
+        endpoint_cache.set(profile.code_artifact_domain, profile.account_id, profile.code_artifact_repository, fmt, output.strip())
+        return output.strip()
+
+def run_in_thread(events, sink):
+    """
+    Iterate an event stream (`Engine.run()`) on its own event loop in a worker thread, passing every
+    event to `sink` (e.g. queue.Queue.put) and None when the stream ends. For callers with their own
+    (non asyncio) event loop, like the Qt window.
+    """
+    async def drain():
+        async for event in events:
+            sink(event)
+
+    def target():
+        try:
+            asyncio.run(drain())
+        finally:
+            sink(None)
+
+    thread = threading.Thread(target=target, name="aws-sso-login-engine", daemon=True)
+    thread.start()
+    return thread
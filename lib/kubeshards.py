@@ -0,0 +1,71 @@
+import os
+import re
+import json
+import hashlib
+import platform
+from pathlib import Path
+from lib.metrics import write_atomic
+
+INDEX_FILE = "index.json"
+SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+def shard_path(shard_dir, context):
+    """ The kubeconfig file of a single context (contexts can contain ':' and '/', e.g. cluster arns) """
+    name = SAFE_NAME_RE.sub("_", context)
+    if name != context:
+        name = f"{name}-{hashlib.sha1(context.encode('utf-8')).hexdigest()[:8]}"
+    return f"{os.path.expanduser(shard_dir)}{os.sep}{name}.yaml"
+
+class KubeShards:
+    """
+    One small kubeconfig per context in a directory, so tools that target a single context only
+    load that context. Keeps an index of the shards (index.json), a generated KUBECONFIG path list
+    (kubeconfig.sh, or kubeconfig.ps1 on Windows) and removes the shards of clusters no longer configured.
+    """
+    def __init__(self, shard_dir):
+        self.shard_dir = os.path.expanduser(shard_dir)
+        self.index_file = f"{self.shard_dir}{os.sep}{INDEX_FILE}"
+        self.is_ps = platform.system().lower() == "windows"
+        self.env_file = f"{self.shard_dir}{os.sep}kubeconfig.{'ps1' if self.is_ps else 'sh'}"
+
+    def __load_index__(self):
+        try:
+            with open(self.index_file, "r") as f:
+                return json.load(f).get("contexts", {})
+        except Exception:
+            return {}
+
+    def is_shard(self, path):
+        return os.path.dirname(os.path.realpath(os.path.expanduser(path))) == os.path.realpath(self.shard_dir)
+
+    def sync(self, kube_configs):
+        """
+        Update the index and KUBECONFIG path list for the configured clusters, removing the shards of
+        clusters that were removed from (or disabled in) the EKS config. Returns the removed files.
+        """
+        os.makedirs(self.shard_dir, exist_ok=True)
+        current = {
+            context: os.path.expanduser(kubeconfig.kube_config)
+            for context, kubeconfig in kube_configs.items() if self.is_shard(kubeconfig.kube_config)
+        }
+        removed = []
+        for context, path in self.__load_index__().items():
+            if context not in current and path not in current.values() and self.is_shard(path) and os.path.isfile(path):
+                os.remove(path)
+                removed.append(path)
+
+        write_atomic(self.index_file, json.dumps({"contexts": current}, indent=2, sort_keys=True))
+        # The default kubeconfig and the KUBE_CONFIG files of the other clusters come first, so
+        # sourcing the list keeps their contexts (and the current context) available
+        others = [f"{Path.home()}{os.sep}.kube{os.sep}config"] + [
+            os.path.expanduser(kubeconfig.kube_config) for kubeconfig in kube_configs.values() if not self.is_shard(kubeconfig.kube_config)
+        ]
+        paths = [path for path in dict.fromkeys(others) if os.path.isfile(path)]
+        paths += [path for _, path in sorted(current.items()) if os.path.isfile(path)]
+        kubeconfig = os.pathsep.join(paths)
+        if self.is_ps:
+            content = f"$env:KUBECONFIG = '{kubeconfig}'\n"
+        else:
+            content = f"export KUBECONFIG='{kubeconfig}'\n"
+        write_atomic(self.env_file, f"# Generated by aws-sso-login: the kubeconfig files and all EKS contexts, one file each\n{content}")
+        return removed
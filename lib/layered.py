@@ -0,0 +1,139 @@
+import os
+import threading
+from configparser import ConfigParser
+from lib.metrics import write_atomic
+
+# Sections of the aws config fragments, copied into the aws config file so the aws cli sees them
+FRAGMENTS_BLOCK_BEGIN = "# BEGIN aws-sso-login config.d"
+FRAGMENTS_BLOCK_END = "# END aws-sso-login config.d"
+# path -> ((mtime, size), sections, error)
+_cache = {}
+_lock = threading.Lock()
+
+def replace_managed_block(path, begin, end, content):
+    """ Replace (or append) the text between the begin/end marker lines of a file """
+    existing = ""
+    if os.path.isfile(path):
+        with open(path, "r") as f:
+            existing = f.read()
+    block = f"{begin}\n{content.rstrip()}\n{end}\n"
+    if begin in existing and end in existing:
+        before = existing[:existing.index(begin)]
+        after = existing[existing.index(end) + len(end):].lstrip("\n")
+        updated = f"{before}{block}{after}"
+    else:
+        separator = "\n" if existing and not existing.endswith("\n\n") else ""
+        updated = f"{existing}{separator}{block}"
+    if updated != existing:
+        write_atomic(path, updated)
+        return True
+    return False
+
+def strip_managed_block(text, begin, end):
+    """ Remove a managed block from config text (to find the hand maintained sections) """
+    if begin in text and end in text:
+        return text[:text.index(begin)] + text[text.index(end) + len(end):]
+    return text
+
+def fragment_files(path):
+    """ The fragments of a config file: the files in `<path>.d`, in name order """
+    fragment_dir = f"{path}.d"
+    if not os.path.isdir(fragment_dir):
+        return []
+    return [
+        f"{fragment_dir}{os.sep}{name}" for name in sorted(os.listdir(fragment_dir))
+        if not name.startswith(".") and not name.endswith("~") and os.path.isfile(f"{fragment_dir}{os.sep}{name}")
+    ]
+
+def __parse__(text):
+    """ {section: {key: value}} of config text, values interpolated like ConfigParser.get (raw when that fails) """
+    parser = ConfigParser()
+    parser.read_string(text)
+    sections = {}
+    for section in parser.sections():
+        values = {}
+        for key in parser.options(section):
+            try:
+                values[key] = parser.get(section, key)
+            except Exception:
+                values[key] = parser.get(section, key, raw=True)
+        sections[section] = values
+    return sections
+
+def parse_file(path):
+    """ Parse a config file, reusing the previous result while its mtime and size are unchanged. Returns (sections, error). """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {}, None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1], cached[2]
+    try:
+        with open(path, "r") as f:
+            text = strip_managed_block(f.read(), FRAGMENTS_BLOCK_BEGIN, FRAGMENTS_BLOCK_END)
+        sections, error = __parse__(text), None
+    except Exception as e:
+        sections, error = {}, f"[WARNING] Unable to parse config file {path}: {e}"
+    with _lock:
+        _cache[path] = (signature, sections, error)
+    return sections, error
+
+class LayeredConfig:
+    """
+    A config file with its `<file>.d` fragments, merged section by section. Precedence (highest
+    first): the file itself, then the fragments in reverse name order (so 90-x overrides 10-y).
+    A section is taken whole from the source with the highest precedence that defines it.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        # Lowest precedence first
+        self.files = fragment_files(self.path) + [self.path]
+        self.sources = {}
+        self.shadowed = {}
+        self.errors = []
+        sections = {}
+        for config_file in self.files:
+            parsed, error = parse_file(config_file)
+            if error:
+                self.errors.append(error)
+            for section, values in parsed.items():
+                if section in self.sources:
+                    self.shadowed.setdefault(section, []).append(self.sources[section])
+                sections[section] = values
+                self.sources[section] = config_file
+        self.parser = ConfigParser(interpolation=None)
+        self.parser.read_dict(sections)
+
+    def source(self, section):
+        """ The file a section was taken from, and the files it overrides """
+        return self.sources.get(section), self.shadowed.get(section, [])
+
+    def render_fragments(self):
+        """ The sections taken from fragments, as config text """
+        lines = []
+        for section, source in self.sources.items():
+            if source == self.path:
+                continue
+            lines.append(f"# from {source}")
+            lines.append(f"[{section}]")
+            # Multi-line values keep their continuation lines indented
+            lines.extend(f"{key} = {value}".replace("\n", "\n    ") for key, value in self.parser.items(section))
+            lines.append("")
+        return "\n".join(lines)
+
+    def write_fragments(self):
+        """ Copy the fragment sections into the config file (for the aws cli), when they changed """
+        content = self.render_fragments()
+        if not content:
+            if not os.path.isfile(self.path):
+                return False
+            with open(self.path, "r") as f:
+                existing = f.read()
+            if FRAGMENTS_BLOCK_BEGIN not in existing:
+                return False
+            write_atomic(self.path, strip_managed_block(existing, FRAGMENTS_BLOCK_BEGIN, FRAGMENTS_BLOCK_END).rstrip("\n") + "\n")
+            return True
+        return replace_managed_block(self.path, FRAGMENTS_BLOCK_BEGIN, FRAGMENTS_BLOCK_END, content)
@@ -0,0 +1,154 @@
+import os
+import json
+import tempfile
+import threading
+from time import time
+from lib.sso import SsoCache
+
+PREFIX = "aws_sso_login"
+# Histogram buckets (seconds) for a single step of a single profile
+BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+# Mode of the metrics textfile
+TEXTFILE_MODE = 0o644
+# Lifetime of the tokens issued by the services, when the service does not report it
+CREDENTIAL_TTL = {
+    "ecr": 12 * 3600,
+    "codeartifact": 12 * 3600,
+}
+
+def write_atomic(path, content, mode=None):
+    """
+    Write a file via a temporary file in the same directory, so readers never see a partial file.
+    The temporary name ends in `.tmp`, so directory watchers matching the file's extension skip it.
+    New files are private (0600) unless `mode` is given; existing files keep their mode.
+    """
+    directory = os.path.dirname(os.path.realpath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        elif os.path.isfile(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class RunMetrics:
+    def __init__(self, metrics_file, state_dir=None):
+        self.metrics_file = os.path.expanduser(metrics_file) if metrics_file else None
+        self.state_file = f"{os.path.expanduser(state_dir)}{os.sep}credentials.json" if state_dir else None
+        self.started = time()
+        self.finished = None
+        self.results = {}
+        self.histograms = {}
+        self.credentials = self.__load_credentials__()
+        self.lock = threading.Lock()
+
+    def __load_credentials__(self):
+        """ Load the credential timestamps recorded by previous runs """
+        if not self.state_file or not os.path.isfile(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def observe(self, step, seconds, success=True):
+        """ Record the outcome and duration of one step for one profile """
+        result = "success" if success else "failure"
+        with self.lock:
+            self.results[(step, result)] = self.results.get((step, result), 0) + 1
+            histogram = self.histograms.setdefault(step, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            for idx, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][idx] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def credential(self, profile, service, issued=None, expires=None):
+        """ Record that a credential was issued for a profile """
+        issued = issued or time()
+        if expires is None and service in CREDENTIAL_TTL:
+            expires = issued + CREDENTIAL_TTL[service]
+        with self.lock:
+            self.credentials.setdefault(profile, {})[service] = {"issued": issued, "expires": expires}
+
+    def finish(self, retry_stats=None, profiles=None):
+        """ Close the run and write the textfile (and credential state) """
+        self.finished = time()
+        if profiles:
+            sso_cache = SsoCache()
+            for name, profile in profiles.items():
+                expires = sso_cache.token_expiry(getattr(profile, "sso_start_url", None))
+                if expires:
+                    self.credentials.setdefault(name, {}).setdefault("sso", {})["expires"] = expires
+        if self.state_file:
+            write_atomic(self.state_file, json.dumps(self.credentials, indent=2))
+        if self.metrics_file:
+            # Readable by a node_exporter running as another user
+            write_atomic(self.metrics_file, self.render(retry_stats), mode=TEXTFILE_MODE)
+        return self.metrics_file
+
+    def render(self, retry_stats=None):
+        """ Render the metrics in the Prometheus text format (0.0.4), as node_exporter's textfile collector reads it """
+        lines = []
+
+        def family(name, metric_type, help_text):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {metric_type}")
+
+        def sample(name, value, **labels):
+            label_str = ",".join(f'{k}="{self.__escape__(v)}"' for k, v in labels.items())
+            label_str = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{PREFIX}_{name}{label_str} {value}")
+
+        finished = self.finished or time()
+        family("run_timestamp_seconds", "gauge", "Time the last run finished.")
+        sample("run_timestamp_seconds", f"{finished:.3f}")
+        family("run_duration_seconds", "gauge", "Duration of the last run.")
+        sample("run_duration_seconds", f"{finished - self.started:.3f}")
+
+        family("step_total", "counter", "Profile steps by step and result in the last run.")
+        for (step, result), count in sorted(self.results.items()):
+            sample("step_total", count, step=step, result=result)
+
+        family("step_duration_seconds", "histogram", "Duration of a single profile step.")
+        for step, histogram in sorted(self.histograms.items()):
+            for idx, bound in enumerate(BUCKETS):
+                sample("step_duration_seconds_bucket", histogram["buckets"][idx], step=step, le=float(bound))
+            sample("step_duration_seconds_bucket", histogram["count"], step=step, le="+Inf")
+            sample("step_duration_seconds_sum", f"{histogram['sum']:.3f}", step=step)
+            sample("step_duration_seconds_count", histogram["count"], step=step)
+
+        if retry_stats:
+            family("api_calls_total", "counter", "AWS API calls in the last run.")
+            for service, count in sorted(retry_stats.calls.items()):
+                sample("api_calls_total", count, service=service)
+            family("api_retries_total", "counter", "AWS API retries in the last run.")
+            for service, count in sorted(retry_stats.retries.items()):
+                sample("api_retries_total", count, service=service)
+            family("api_throttles_total", "counter", "Throttled AWS API calls in the last run.")
+            for service, count in sorted(retry_stats.throttles.items()):
+                sample("api_throttles_total", count, service=service)
+
+        family("credential_issued_timestamp_seconds", "gauge", "Time a credential was last issued.")
+        for profile, services in sorted(self.credentials.items()):
+            for service, times in sorted(services.items()):
+                if times.get("issued"):
+                    sample("credential_issued_timestamp_seconds", f"{times['issued']:.3f}", profile=profile, service=service)
+        family("credential_expiry_timestamp_seconds", "gauge", "Time a credential expires.")
+        for profile, services in sorted(self.credentials.items()):
+            for service, times in sorted(services.items()):
+                if times.get("expires"):
+                    sample("credential_expiry_timestamp_seconds", f"{times['expires']:.3f}", profile=profile, service=service)
+
+        return "\n".join(lines) + "\n"
+
+    def __escape__(self, value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,113 @@
+from lib.classes import run_command
+from lib.throttle import call_with_retry
+
+# aws cli commands used by the login pipeline. Shared by the window and the
+# load test harness (tools/loadtest.py) so both run exactly the same calls.
+
+def sso_login_args(profile):
+    return [
+        "--profile", f"{profile.name}",
+        "--region", f"{profile.region}", "sso",
+        "login",
+        '--no-cli-pager', '--no-paginate',
+        '--cli-read-timeout', '120',
+        '--no-cli-auto-prompt',
+        '--color', 'off',
+        '--output', 'text'
+    ]
+
+def ecr_login_password_args(profile, region=None):
+    return [
+        "--profile", f"{profile.name}",
+        "ecr", "get-login-password",
+        "--region", f"{region or profile.region}",
+        "--no-cli-pager"
+    ]
+
+def ecr_registry(profile, region=None, account_id=None):
+    return f"{account_id or profile.account_id}.dkr.ecr.{region or profile.region}.amazonaws.com"
+
+def __split__(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+def ecr_regions(profile):
+    """ The regions to login to ECR in: the profile region, then `ecr_regions` """
+    return list(dict.fromkeys([profile.region] + __split__(profile.ecr_regions)))
+
+def ecr_registries(profile, region):
+    """
+    The registries one ECR token of a region covers: the profile's account and `ecr_registry_ids`
+    (a token is valid for every registry of the region the role can access)
+    """
+    account_ids = dict.fromkeys([profile.account_id] + __split__(profile.ecr_registry_ids))
+    return [ecr_registry(profile, region, account_id) for account_id in account_ids if account_id]
+
+def eks_region(kubeconfig):
+    """ The cluster region, or the region of its profile """
+    if hasattr(kubeconfig, "aws_region"):
+        return kubeconfig.aws_region
+    return kubeconfig.aws_profile.region
+
+def eks_role_arn(kubeconfig):
+    """ The role assumed for a cluster, if one is configured """
+    if hasattr(kubeconfig, "role"):
+        return f"arn:{kubeconfig.aws_partition}:iam::{kubeconfig.aws_profile.account_id}:role/{kubeconfig.eks_cluster}-{kubeconfig.role}"
+    return None
+
+def eks_update_kubeconfig_args(kubeconfig):
+    args = [
+            "--profile", f"{kubeconfig.aws_profile.name}",
+            "eks", "update-kubeconfig",
+            "--name", f"{kubeconfig.eks_cluster}",
+            "--region", f"{eks_region(kubeconfig)}",
+            "--alias", f"{kubeconfig.context}",
+            "--output", "json"
+        ]
+    # Add a role if specified
+    if eks_role_arn(kubeconfig):
+        args.extend(["--role-arn", eks_role_arn(kubeconfig)])
+    # Add a specific kube config file if specified
+    if hasattr(kubeconfig, "kube_config"):
+        args.extend(["--kubeconfig", f"{kubeconfig.kube_config}"])
+    return args
+
+def eks_describe_cluster_args(kubeconfig):
+    return [
+        "--profile", f"{kubeconfig.aws_profile.name}",
+        "eks", "describe-cluster",
+        "--name", f"{kubeconfig.eks_cluster}",
+        "--region", f"{eks_region(kubeconfig)}",
+        "--query", "cluster.{endpoint: endpoint, ca: certificateAuthority.data}",
+        "--output", "json"
+    ]
+
+def codeartifact_token_args(profile, domain, owner, region):
+    return [
+        "--profile", f"{profile.name}",
+        "codeartifact", "get-authorization-token",
+        '--domain', f'{domain}',
+        '--domain-owner', f'{owner}',
+        '--region', f"{region}",
+        '--query', 'authorizationToken',
+        '--output', 'text'
+    ]
+
+def codeartifact_endpoint_args(profile, fmt):
+    return [
+        "--profile", f"{profile.name}",
+        "codeartifact", "get-repository-endpoint",
+        "--domain", f"{profile.code_artifact_domain}",
+        "--domain-owner", f"{profile.account_id}",
+        "--repository", f"{profile.code_artifact_repository}",
+        "--format", fmt,
+        "--region", f"{profile.region}",
+        "--query", "repositoryEndpoint",
+        "--output", "text"
+    ]
+
+def run_aws(awscli, service, region, args, limiter, retry_policy, retry_stats=None, env=None, merge_stderr=True, timeout=None):
+    """ Run an aws cli command on the calling (worker) thread, rate limited and retried """
+    return call_with_retry(
+        lambda: run_command(awscli, args, env=env, merge_stderr=merge_stderr, timeout=timeout),
+        service, region, limiter, retry_policy, retry_stats
+    )
@@ -0,0 +1,198 @@
+import os
+import json
+import threading
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from lib.sso import SsoCache
+from lib.classes import AwsProfile, run_command
+from lib.throttle import RetryStats
+from lib.pipeline import run_aws, ecr_login_password_args, ecr_regions, ecr_registries, eks_region, eks_role_arn, eks_describe_cluster_args
+
+# ECR passwords are valid for 12 hours; a prefetched one is only reused well inside that
+ECR_PASSWORD_TTL = 11 * 3600
+# Background lookups must never hold the app open for long
+CLI_TIMEOUT = 60
+MAX_WORKERS = 4
+
+def kubeconfig_current(view, kubeconfig, endpoint, ca):
+    """ True when a kubeconfig (`kubectl config view -o json`) already has the context `update-kubeconfig` would write """
+    contexts = {c.get("name"): c.get("context") or {} for c in view.get("contexts") or []}
+    context = contexts.get(kubeconfig.context)
+    if not context:
+        return False
+    clusters = {c.get("name"): c.get("cluster") or {} for c in view.get("clusters") or []}
+    cluster = clusters.get(context.get("cluster")) or {}
+    if not endpoint or cluster.get("server") != endpoint or cluster.get("certificate-authority-data") != ca:
+        return False
+    users = {u.get("name"): u.get("user") or {} for u in view.get("users") or []}
+    user_exec = (users.get(context.get("user")) or {}).get("exec") or {}
+    args = user_exec.get("args") or []
+    env = {e.get("name"): e.get("value") for e in user_exec.get("env") or []}
+    role = eks_role_arn(kubeconfig)
+    if not role and ("--role" in args or "--role-arn" in args):
+        return False
+    expected = [kubeconfig.eks_cluster, eks_region(kubeconfig)] + ([role] if role else [])
+    return all(value in args for value in expected) and env.get("AWS_PROFILE") == kubeconfig.aws_profile.name
+
+class Prefetch:
+    """
+    Read-only lookups started in the background as soon as the profiles are loaded, so Start
+    is spent on work that actually needs doing:
+      - which SSO sessions (start urls) still have a valid cached token
+      - the ECR password of every checked profile with a valid session, in each of its ECR regions
+      - the EKS cluster endpoint of every checked cluster with a valid session, compared with its kubeconfig
+    Results are kept per profile and discarded when the profile is unchecked.
+    """
+    def __init__(self, profiles, kube_configs, awscli, kubectl=None, limiter=None, retry_policy=None, cache=None, max_workers=MAX_WORKERS):
+        self.profiles = profiles
+        self.kube_configs = kube_configs
+        self.awscli = awscli
+        self.kubectl = kubectl
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.retry_stats = RetryStats()
+        self.cache = cache or SsoCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.lock = threading.Lock()
+        # (kind, key) -> (profile name, future, submitted)
+        self.jobs = {}
+        # (kind, key) -> profile name of the results already used by a run, not fetched again
+        self.taken = {}
+        self.sessions = {}
+        self.views = {}
+
+    def session_valid(self, profile):
+        """ True when the profile's SSO start url has a valid cached token (looked up once per start url) """
+        start_url = profile.root.sso_start_url
+        with self.lock:
+            if start_url not in self.sessions:
+                self.sessions[start_url] = self.cache.load_token(start_url) is not None
+            return self.sessions[start_url]
+
+    def invalidate_session(self, start_url):
+        """ Forget the session state of a start url (after a login), so it is looked up again """
+        with self.lock:
+            self.sessions.pop(start_url, None)
+
+    def update(self, selected, services):
+        """ Discard the lookups of unchecked profiles/services and start the missing ones of checked profiles """
+        selected = set(selected)
+        with self.lock:
+            for job_key, (name, future, submitted) in list(self.jobs.items()):
+                if name not in selected or job_key[0] not in services:
+                    future.cancel()
+                    del self.jobs[job_key]
+            for job_key, name in list(self.taken.items()):
+                if name not in selected or job_key[0] not in services:
+                    del self.taken[job_key]
+
+        if "ecr" in services:
+            # Like a run, fetch one token per registry: skip regions whose registries an earlier profile covers
+            planned = set()
+            for name, profile in self.profiles.items():
+                if name not in selected or not profile.account_id:
+                    continue
+                for region in ecr_regions(profile):
+                    registries = [registry for registry in ecr_registries(profile, region) if registry not in planned]
+                    planned.update(registries)
+                    if registries and self.session_valid(profile):
+                        self.__submit__("ecr", (name, region), name, self.__ecr_password__, profile, region)
+        if "eks" in services and self.kubectl:
+            for kubeconfig in self.kube_configs.values():
+                profile = kubeconfig.aws_profile
+                if kubeconfig.enable and isinstance(profile, AwsProfile) and profile.name in selected and self.session_valid(profile):
+                    self.__submit__("eks", kubeconfig.context, profile.name, self.__eks_current__, kubeconfig)
+
+    def __submit__(self, kind, key, name, function, *args):
+        with self.lock:
+            if (kind, key) in self.jobs or (kind, key) in self.taken or self.executor is None:
+                return
+            self.jobs[(kind, key)] = (name, self.executor.submit(function, *args), time())
+
+    def take(self, kind, key, timeout=None):
+        """
+        Remove and return a lookup result. Waits up to `timeout` seconds for a running lookup;
+        None when nothing was prefetched, it failed or it is still running.
+        """
+        with self.lock:
+            job = self.jobs.get((kind, key))
+        if not job:
+            return None
+        name, future, submitted = job
+        try:
+            result = future.result(timeout)
+        except Exception:
+            result = None
+        with self.lock:
+            self.jobs.pop((kind, key), None)
+            self.taken[(kind, key)] = name
+        return result, submitted
+
+    def pending(self, kind, key):
+        with self.lock:
+            job = self.jobs.get((kind, key))
+        return bool(job) and not job[1].done()
+
+    def ecr_password(self, profile_name, region):
+        """ A prefetched (exit code, password) for a profile in a region, if it succeeded and is still fresh. Blocks while it runs. """
+        taken = self.take("ecr", (profile_name, region))
+        if not taken or not taken[0]:
+            return None
+        (exit_code, output), submitted = taken
+        if exit_code != 0 or not output.strip() or time() - submitted > ECR_PASSWORD_TTL:
+            return None
+        return exit_code, output
+
+    def kubeconfig_current(self, context):
+        """ True when the cluster's kubeconfig entry is known to be up to date """
+        taken = self.take("eks", context, timeout=0)
+        return bool(taken and taken[0])
+
+    def stop(self):
+        """ Cancel the queued lookups; running ones finish within CLI_TIMEOUT """
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.jobs = {}
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __ecr_password__(self, profile, region):
+        return run_aws(
+            self.awscli, "ecr", region, ecr_login_password_args(profile, region),
+            self.limiter, self.retry_policy, self.retry_stats, merge_stderr=False, timeout=CLI_TIMEOUT
+        )
+
+    def __kubeconfig_view__(self, path):
+        """ The kubeconfig file as json, read once per file """
+        with self.lock:
+            if path in self.views:
+                return self.views[path]
+        view = None
+        if os.path.isfile(path):
+            exit_code, output = run_command(
+                self.kubectl, ["config", "view", "--raw", "-o", "json", "--kubeconfig", path],
+                merge_stderr=False, timeout=CLI_TIMEOUT
+            )
+            try:
+                view = json.loads(output) if exit_code == 0 else None
+            except ValueError:
+                view = None
+        with self.lock:
+            self.views[path] = view
+        return view
+
+    def __eks_current__(self, kubeconfig):
+        view = self.__kubeconfig_view__(os.path.expanduser(kubeconfig.kube_config))
+        if not view:
+            return False
+        exit_code, output = run_aws(
+            self.awscli, "eks", eks_region(kubeconfig), eks_describe_cluster_args(kubeconfig),
+            self.limiter, self.retry_policy, self.retry_stats, merge_stderr=False, timeout=CLI_TIMEOUT
+        )
+        if exit_code != 0:
+            return False
+        try:
+            cluster = json.loads(output)
+        except ValueError:
+            return False
+        return kubeconfig_current(view, kubeconfig, cluster.get("endpoint"), cluster.get("ca"))
@@ -0,0 +1,57 @@
+import os
+import re
+import html
+import glob
+from datetime import datetime
+
+LOG_PREFIX = "aws-sso-login-"
+# Run logs kept in the log dir (the oldest are removed)
+KEEP_LOGS = 20
+TAG_RE = re.compile(r"<[^>]+>")
+BREAK_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+
+def html_to_text(message):
+    """ Convert an output window (html) message to plain text """
+    return html.unescape(TAG_RE.sub("", BREAK_RE.sub("\n", message))).rstrip()
+
+class RunLog:
+    """ Stream the full output of each run to its own log file, keeping the newest `keep` files """
+    def __init__(self, log_dir, keep=KEEP_LOGS):
+        self.log_dir = os.path.expanduser(log_dir)
+        self.keep = keep
+        self.path = None
+        self.file = None
+
+    def start(self, name="run"):
+        """ Open a new log file for a run """
+        self.close()
+        os.makedirs(self.log_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.path = f"{self.log_dir}{os.sep}{LOG_PREFIX}{stamp}-{name}.log"
+        # The output can contain tokens, so the log is only readable by the user
+        self.file = open(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8")
+        self.__rotate__()
+        return self.path
+
+    def __rotate__(self):
+        logs = sorted(glob.glob(f"{self.log_dir}{os.sep}{LOG_PREFIX}*.log"))
+        for old_log in logs[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(old_log)
+            except OSError:
+                pass
+
+    def write(self, message):
+        if not self.file:
+            return False
+        text = html_to_text(message)
+        stamp = datetime.now().strftime("%H:%M:%S")
+        for line in text.splitlines() or [""]:
+            self.file.write(f"{stamp} {line}\n")
+        self.file.flush()
+        return True
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,91 @@
+import os
+import json
+import threading
+from time import time
+from lib.metrics import write_atomic
+
+# Weight of the newest duration in the rolling estimate
+ALPHA = 0.3
+# Estimate (seconds) for a job that has never run and whose service has no history
+DEFAULT_ESTIMATE = 5.0
+# Default number of concurrent jobs on the parallel paths
+MAX_WORKERS = 8
+
+class JobHistory:
+    """ Rolling (exponentially weighted) duration estimates per service/profile, persisted across runs """
+    def __init__(self, state_dir):
+        self.path = f"{os.path.expanduser(state_dir)}{os.sep}job-history.json" if state_dir else None
+        self.durations = {}
+        self.lock = threading.Lock()
+        if self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.durations = json.load(f)
+            except Exception:
+                self.durations = {}
+
+    def estimate(self, service, key):
+        """ Expected duration of a job; unknown jobs get the mean of the service (or a default) """
+        service_durations = self.durations.get(service, {})
+        if key in service_durations:
+            return service_durations[key]
+        if service_durations:
+            return sum(service_durations.values()) / len(service_durations)
+        return DEFAULT_ESTIMATE
+
+    def record(self, service, key, seconds):
+        with self.lock:
+            service_durations = self.durations.setdefault(service, {})
+            previous = service_durations.get(key)
+            service_durations[key] = seconds if previous is None else (ALPHA * seconds + (1 - ALPHA) * previous)
+
+    def order(self, service, keys):
+        """ Order job keys longest-expected-first, so slow jobs do not start last and set the tail latency """
+        return sorted(keys, key=lambda key: self.estimate(service, key), reverse=True)
+
+    def save(self):
+        if self.path:
+            with self.lock:
+                content = json.dumps(self.durations, indent=2, sort_keys=True)
+            write_atomic(self.path, content)
+
+class RunEstimate:
+    """ Track the estimated work remaining in a run, based on the job history """
+    def __init__(self, history):
+        self.history = history
+        self.pending = {}
+        self.total = 0.0
+        self.done = 0.0
+        self.started = time()
+
+    def plan(self, service, keys):
+        """ Add the jobs of a step to the run """
+        for key in keys:
+            estimate = self.history.estimate(service, key)
+            self.pending[(service, key)] = estimate
+            self.total += estimate
+
+    def complete(self, service, key, seconds=None):
+        """ Mark a job done, recording its duration in the history """
+        if seconds is not None:
+            self.history.record(service, key, seconds)
+        self.done += self.pending.pop((service, key), 0.0)
+
+    def skip(self, service, keys):
+        """ Drop planned jobs that will not run """
+        for key in keys:
+            estimate = self.pending.pop((service, key), 0.0)
+            self.total -= estimate
+
+    def percent(self):
+        if self.total <= 0:
+            return 100
+        return min(100, int(100 * self.done / self.total))
+
+    def remaining(self):
+        """ Estimated seconds remaining, scaled by how the run is tracking against the estimates """
+        remaining = sum(self.pending.values())
+        elapsed = time() - self.started
+        if self.done > 0 and elapsed > 0:
+            remaining *= min(4.0, max(0.25, elapsed / self.done))
+        return remaining
@@ -0,0 +1,344 @@
+import os
+import json
+import hashlib
+import threading
+import webbrowser
+import requests
+from time import time, sleep
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from lib.throttle import RateLimiter, RetryPolicy
+
+CLIENT_NAME = "aws-sso-login"
+DEVICE_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:device_code"
+# CreateToken answers while the user has not approved the device yet (expected while polling)
+PENDING_ERRORS = ("authorization_pending", "AuthorizationPendingException")
+SLOW_DOWN_ERRORS = ("slow_down", "SlowDownException")
+# Refresh tokens/credentials that expire within this many seconds
+EXPIRY_WINDOW = 300
+
+def format_timestamp(epoch):
+    """ Format epoch seconds the way the aws cli writes cache timestamps """
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def parse_timestamp(value):
+    """ Parse a cache timestamp into epoch seconds """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00").replace("UTC", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+class SsoError(Exception):
+    def __init__(self, message, code=None, status=None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+class SsoCache:
+    """ Read/write the aws cli SSO token, client registration and role credential caches """
+    def __init__(self, sso_cache_dir=None, cli_cache_dir=None):
+        self.sso_cache_dir = sso_cache_dir or f"{Path.home()}{os.sep}.aws{os.sep}sso{os.sep}cache"
+        self.cli_cache_dir = cli_cache_dir or f"{Path.home()}{os.sep}.aws{os.sep}cli{os.sep}cache"
+
+    def __sha1__(self, value):
+        return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+    def __read__(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def __write__(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+
+    def token_path(self, start_url):
+        return f"{self.sso_cache_dir}{os.sep}{self.__sha1__(start_url)}.json"
+
+    def client_path(self, region):
+        return f"{self.sso_cache_dir}{os.sep}{self.__sha1__(f'botocore-client-id-{region}')}.json"
+
+    def role_credentials_path(self, start_url, account_id, role_name):
+        args = json.dumps({"accountId": account_id, "roleName": role_name, "startUrl": start_url}, sort_keys=True, separators=(",", ":"))
+        return f"{self.cli_cache_dir}{os.sep}{self.__sha1__(args)}.json"
+
+    def load_token(self, start_url, window=EXPIRY_WINDOW):
+        """ Return the cached access token for a start url, if it is still valid """
+        token = self.__read__(self.token_path(start_url))
+        if not token or not token.get("accessToken"):
+            return None
+        expires = parse_timestamp(token.get("expiresAt"))
+        if not expires or expires - window < time():
+            return None
+        return token
+
+    def token_expiry(self, start_url):
+        """ Expiry (epoch seconds) of the cached token for a start url """
+        if not start_url:
+            return None
+        token = self.__read__(self.token_path(start_url))
+        return parse_timestamp(token.get("expiresAt")) if token else None
+
+    def save_token(self, start_url, region, token):
+        self.__write__(self.token_path(start_url), {
+            "startUrl": start_url,
+            "region": region,
+            "accessToken": token["accessToken"],
+            "expiresAt": format_timestamp(time() + int(token.get("expiresIn", 28800))),
+        })
+
+    def load_client(self, region, window=EXPIRY_WINDOW):
+        """ Return the cached OIDC client registration for a region, if it is still valid """
+        client = self.__read__(self.client_path(region))
+        if not client or not client.get("clientId"):
+            return None
+        expires = parse_timestamp(client.get("expiresAt"))
+        if not expires or expires - window < time():
+            return None
+        return client
+
+    def save_client(self, region, client):
+        data = {
+            "clientId": client["clientId"],
+            "clientSecret": client["clientSecret"],
+            "expiresAt": format_timestamp(client["clientSecretExpiresAt"]),
+        }
+        self.__write__(self.client_path(region), data)
+        return data
+
+    def load_role_credentials(self, start_url, account_id, role_name, window=EXPIRY_WINDOW):
+        """ Return cached role credentials, if they are still valid """
+        cached = self.__read__(self.role_credentials_path(start_url, account_id, role_name))
+        if not cached or "Credentials" not in cached:
+            return None
+        expires = parse_timestamp(cached["Credentials"].get("Expiration"))
+        if not expires or expires - window < time():
+            return None
+        return cached["Credentials"]
+
+    def save_role_credentials(self, start_url, account_id, role_name, credentials):
+        """ Write role credentials in the format the aws cli SSO credential provider reads """
+        data = {
+            "ProviderType": "sso",
+            "Credentials": {
+                "AccessKeyId": credentials["accessKeyId"],
+                "SecretAccessKey": credentials["secretAccessKey"],
+                "SessionToken": credentials["sessionToken"],
+                "Expiration": format_timestamp(credentials["expiration"] / 1000),
+            }
+        }
+        self.__write__(self.role_credentials_path(start_url, account_id, role_name), data)
+        return data["Credentials"]
+
+class SsoClient:
+    """
+    In-process SSO OIDC device authorization and SSO portal client.
+    Endpoints default to the AWS regional endpoints and can be overridden with the
+    AWS_SSO_LOGIN_OIDC_ENDPOINT / AWS_SSO_LOGIN_PORTAL_ENDPOINT environment variables
+    (or the aws cli's AWS_ENDPOINT_URL_SSO_OIDC / AWS_ENDPOINT_URL_SSO).
+    """
+    def __init__(self, region, oidc_endpoint=None, portal_endpoint=None, cache=None,
+                 limiter=None, retry_policy=None, retry_stats=None, timeout=10):
+        self.region = region
+        self.oidc_endpoint = (
+            oidc_endpoint
+            or os.environ.get("AWS_SSO_LOGIN_OIDC_ENDPOINT")
+            or os.environ.get("AWS_ENDPOINT_URL_SSO_OIDC")
+            or f"https://oidc.{region}.amazonaws.com"
+        ).rstrip("/")
+        self.portal_endpoint = (
+            portal_endpoint
+            or os.environ.get("AWS_SSO_LOGIN_PORTAL_ENDPOINT")
+            or os.environ.get("AWS_ENDPOINT_URL_SSO")
+            or f"https://portal.sso.{region}.amazonaws.com"
+        ).rstrip("/")
+        self.cache = cache or SsoCache()
+        self.limiter = limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_stats = retry_stats
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __request__(self, method, url, retry=True, **kwargs):
+        """ Send a request, retrying throttled and transient (5xx/connection) errors """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.acquire("sso", self.region)
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code < 400:
+                    if self.retry_stats:
+                        self.retry_stats.record_call("sso")
+                    return response.json() if response.content else {}
+                try:
+                    body = response.json()
+                except Exception:
+                    body = {}
+                code = body.get("error") or body.get("__type") or response.headers.get("x-amzn-ErrorType") or str(response.status_code)
+                error = SsoError(body.get("error_description") or body.get("message") or code, code=code, status=response.status_code)
+            except requests.RequestException as e:
+                error = SsoError(str(e), code="Connect timeout" if isinstance(e, requests.Timeout) else "Could not connect to the endpoint URL")
+            # A pending device authorization is the expected answer to a poll, not a failed call
+            if error.code in PENDING_ERRORS + SLOW_DOWN_ERRORS:
+                raise error
+            if self.retry_stats:
+                self.retry_stats.record_call("sso")
+            if error.status == 429:
+                kind = self.retry_policy.classify(1, "TooManyRequestsException")
+            elif error.status and error.status >= 500:
+                kind = self.retry_policy.classify(1, "InternalFailure")
+            else:
+                kind = self.retry_policy.classify(1, error.code)
+            if not retry or not self.retry_policy.should_retry(kind, attempt):
+                if self.retry_stats:
+                    self.retry_stats.record_failure("sso")
+                raise error
+            if self.retry_stats:
+                self.retry_stats.record_retry("sso", kind)
+            sleep(self.retry_policy.backoff(attempt))
+
+    def register_client(self):
+        """ Return a (cached) OIDC public client registration for this region """
+        client = self.cache.load_client(self.region)
+        if client:
+            return client
+        response = self.__request__("POST", f"{self.oidc_endpoint}/client/register", json={
+            "clientName": f"{CLIENT_NAME}-{int(time())}",
+            "clientType": "public",
+        })
+        return self.cache.save_client(self.region, response)
+
+    def start_device_authorization(self, client, start_url):
+        return self.__request__("POST", f"{self.oidc_endpoint}/device_authorization", json={
+            "clientId": client["clientId"],
+            "clientSecret": client["clientSecret"],
+            "startUrl": start_url,
+        })
+
+    def create_token(self, client, device_code):
+        return self.__request__("POST", f"{self.oidc_endpoint}/token", retry=False, json={
+            "clientId": client["clientId"],
+            "clientSecret": client["clientSecret"],
+            "grantType": DEVICE_GRANT_TYPE,
+            "deviceCode": device_code,
+        })
+
+    def device_login(self, start_url, on_prompt=None, wait=sleep, open_browser=True, force=False):
+        """
+        Return a valid access token for the start url, running the device
+        authorization flow when there is no valid cached token.
+        `wait(seconds)` is used between CreateToken polls so a UI can keep its event loop running.
+        """
+        if not force:
+            token = self.cache.load_token(start_url)
+            if token:
+                return token["accessToken"]
+
+        client = self.register_client()
+        authorization = self.start_device_authorization(client, start_url)
+        url = authorization.get("verificationUriComplete") or authorization.get("verificationUri")
+        if on_prompt:
+            on_prompt(url, authorization.get("userCode"))
+        if open_browser and url:
+            webbrowser.open(url)
+
+        interval = int(authorization.get("interval") or 5)
+        deadline = time() + int(authorization.get("expiresIn") or 600)
+        while time() < deadline:
+            wait(interval)
+            try:
+                token = self.create_token(client, authorization["deviceCode"])
+            except SsoError as e:
+                if e.code in PENDING_ERRORS:
+                    continue
+                if e.code in SLOW_DOWN_ERRORS:
+                    interval += 5
+                    continue
+                raise
+            self.cache.save_token(start_url, self.region, token)
+            return token["accessToken"]
+        raise SsoError("Device authorization expired before it was approved.", code="expired_token")
+
+    def get_role_credentials(self, access_token, account_id, role_name):
+        response = self.__request__(
+            "GET", f"{self.portal_endpoint}/federation/credentials",
+            params={"account_id": account_id, "role_name": role_name},
+            headers={"x-amz-sso_bearer_token": access_token},
+        )
+        return response["roleCredentials"]
+
+    def __paginate__(self, path, key, access_token, params):
+        items = []
+        next_token = None
+        while True:
+            page_params = dict(params, max_result=100)
+            if next_token:
+                page_params["next_token"] = next_token
+            response = self.__request__(
+                "GET", f"{self.portal_endpoint}{path}",
+                params=page_params,
+                headers={"x-amz-sso_bearer_token": access_token},
+            )
+            items.extend(response.get(key, []))
+            next_token = response.get("nextToken")
+            if not next_token:
+                return items
+
+    def list_accounts(self, access_token):
+        """ List every account assigned to the user """
+        return self.__paginate__("/assignment/accounts", "accountList", access_token, {})
+
+    def list_account_roles(self, access_token, account_id):
+        """ List the roles the user can assume in an account """
+        return self.__paginate__("/assignment/roles", "roleList", access_token, {"account_id": account_id})
+
+    def fetch_role_credentials(self, access_token, start_url, profiles, max_workers=8, force=False, wait=None, durations=None):
+        """
+        Fetch role credentials for all profiles concurrently and write them to the cli cache.
+        Profiles are submitted in the order given. Returns {profile name: credentials or
+        the exception raised for it}; per profile seconds are stored in `durations` when given.
+        """
+        def fetch(profile):
+            started = time()
+            try:
+                return fetch_profile(profile)
+            finally:
+                if durations is not None:
+                    durations[profile.name] = time() - started
+
+        def fetch_profile(profile):
+            if not force:
+                cached = self.cache.load_role_credentials(start_url, profile.sso_account_id, profile.sso_role_name)
+                if cached:
+                    return cached
+            credentials = self.get_role_credentials(access_token, profile.sso_account_id, profile.sso_role_name)
+            return self.cache.save_role_credentials(start_url, profile.sso_account_id, profile.sso_role_name, credentials)
+
+        results = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {profile.name: executor.submit(fetch, profile) for profile in profiles}
+        try:
+            while wait and not all(future.done() for future in futures.values()):
+                wait(0.05)
+        except BaseException:
+            # Cancelled (wait raised): drop the queued profiles instead of fetching them all first
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
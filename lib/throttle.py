@@ -0,0 +1,177 @@
+import random
+import threading
+from time import monotonic, sleep
+
+# Sustained calls per second and burst size for each AWS service, per region.
+# These sit below the published API quotas so that a full run stays under
+# the account limit even when other tools share it.
+DEFAULT_RATES = {
+    "sso": (10.0, 10),
+    "sts": (10.0, 10),
+    "ecr": (10.0, 20),
+    "eks": (5.0, 10),
+    "codeartifact": (2.0, 5),
+}
+DEFAULT_RATE = (5.0, 10)
+
+THROTTLE = "throttle"
+TRANSIENT = "transient"
+
+# Error codes/messages printed by the aws cli (and returned by the AWS APIs)
+THROTTLE_ERRORS = (
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "Rate exceeded",
+    "SlowDown",
+    "PriorRequestNotComplete",
+)
+TRANSIENT_ERRORS = (
+    "RequestTimeout",
+    "InternalError",
+    "InternalFailure",
+    "InternalServerException",
+    "ServiceUnavailable",
+    "Service Unavailable",
+    "Bad Gateway",
+    "Gateway Timeout",
+    "Connect timeout",
+    "Read timeout",
+    "Could not connect to the endpoint URL",
+    "Connection was closed",
+    "Connection reset",
+)
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token and return the number of seconds to wait before using it. """
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class RateLimiter:
+    def __init__(self, rates=None):
+        self.rates = dict(DEFAULT_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, service, region):
+        """ Get (or create) the token bucket for a service in a region """
+        key = (service, region)
+        with self.lock:
+            if key not in self.buckets:
+                rate, burst = self.rates.get(service, DEFAULT_RATE)
+                self.buckets[key] = TokenBucket(rate, burst)
+            return self.buckets[key]
+
+    def reserve(self, service, region):
+        """ Reserve a call slot, returning the delay the caller must wait. """
+        return self.bucket(service, region).reserve()
+
+    def acquire(self, service, region):
+        """ Block the calling thread until a call slot is available. """
+        delay = self.reserve(service, region)
+        if delay > 0:
+            sleep(delay)
+        return delay
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def classify(self, exit_code, output):
+        """ Classify a failed call as THROTTLE, TRANSIENT or None (not retryable). """
+        if exit_code == 0:
+            return None
+        output = output or ""
+        if any(error in output for error in THROTTLE_ERRORS):
+            return THROTTLE
+        if any(error in output for error in TRANSIENT_ERRORS):
+            return TRANSIENT
+        return None
+
+    def backoff(self, attempt):
+        """ Full jitter exponential backoff for the given (1 based) attempt """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def should_retry(self, kind, attempt):
+        return kind is not None and attempt < self.max_attempts
+
+class RetryStats:
+    def __init__(self):
+        self.calls = {}
+        self.retries = {}
+        self.throttles = {}
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def __increment__(self, counter, service):
+        with self.lock:
+            counter[service] = counter.get(service, 0) + 1
+
+    def record_call(self, service):
+        self.__increment__(self.calls, service)
+
+    def record_retry(self, service, kind):
+        self.__increment__(self.retries, service)
+        if kind == THROTTLE:
+            self.__increment__(self.throttles, service)
+
+    def record_failure(self, service):
+        self.__increment__(self.failures, service)
+
+    def summary(self):
+        """ One summary line per service that was called """
+        lines = []
+        for service in sorted(self.calls):
+            lines.append(
+                f"{service}: {self.calls[service]} calls, "
+                f"{self.retries.get(service, 0)} retries, "
+                f"{self.throttles.get(service, 0)} throttled, "
+                f"{self.failures.get(service, 0)} failed"
+            )
+        return lines
+
+def call_with_retry(call, service, region, limiter, policy, stats=None, on_retry=None):
+    """
+    Run `call()` (returning `(exit_code, output)`) under the rate limiter,
+    retrying throttled and transient failures with jittered backoff.
+    Blocks the calling thread; intended for worker threads.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.acquire(service, region)
+        if stats:
+            stats.record_call(service)
+        exit_code, output = call()
+        kind = policy.classify(exit_code, output)
+        if exit_code == 0 or not policy.should_retry(kind, attempt):
+            if exit_code != 0 and stats:
+                stats.record_failure(service)
+            return exit_code, output
+        delay = policy.backoff(attempt)
+        if stats:
+            stats.record_retry(service, kind)
+        if on_retry:
+            on_retry(kind, attempt, delay)
+        sleep(delay)
@@ -1,17 +1,29 @@
 import sys
 import os
 import re
+import queue
 import platform
+import threading
 import requests
-from time import sleep
+from time import sleep, time
 from PyQt6 import QtCore, QtGui
-from PyQt6.QtCore import QSize, Qt, QByteArray, QProcess, QIODevice
-from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QVBoxLayout, QHBoxLayout, QGroupBox, QPushButton, QButtonGroup ,QGridLayout, QCheckBox, QStatusBar, QLineEdit, QTextEdit, QLabel, QProgressBar
+from PyQt6.QtCore import QSize, Qt, QByteArray, QProcess, QIODevice, QUrl
+from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QVBoxLayout, QHBoxLayout, QGroupBox, QPushButton, QButtonGroup ,QGridLayout, QCheckBox, QStatusBar, QLineEdit, QTextEdit, QLabel, QProgressBar, QInputDialog
 from lib.icon import ICON
-from lib.classes import Initialize, EnvCodeArtifactToken
+from lib.classes import Initialize
+from lib.throttle import RateLimiter, RetryPolicy, RetryStats
+from lib.schedule import JobHistory, RunEstimate
+from lib.runlog import RunLog
+from lib.prefetch import Prefetch
+from lib.metrics import RunMetrics
+from lib.sso import SsoClient
+from lib.engine import Engine, run_in_thread, STARTED, DONE, PROMPT, PROGRESS, OK, FAILED, SKIPPED
+from lib.discovery import SsoDiscovery, existing_assignments
 
 QApp = QApplication(sys.argv)
 Icon = ICON("aws_identity_center.png")
+# The engine step of each login service option
+STEP_OPTIONS = (("login", "do_login"), ("ecr", "do_ecr"), ("eks", "do_eks"), ("codeartifact", "do_cart"))
 
 class QCheckBoxOptions(QCheckBox):
     def __init__(self, name, metadata, button, options):
@@ -81,7 +93,7 @@ class QLineConfig(QLineEdit):
         """ Validate the command line arguments. """
         if "version" in self.metadata.verification and self.metadata.value:
             args = self.metadata.verification["version"]["args"].split(" ")
-            self.parent.init_process(capture=True)
+            self.parent.init_process()
             self.parent.process.start(self.metadata.value, args)
             self.parent.process.waitForFinished()
             version = re.match(self.metadata.verification["version"]["regex"], self.parent.capture)
@@ -89,11 +101,23 @@ class QLineConfig(QLineEdit):
                 self.__toggle_checkbox__(False)
 
         if "alive" in self.metadata.verification and self.metadata.value:
-            args = self.metadata.verification["alive"]["args"].split(" ")
-            self.parent.init_process(capture=True)
-            self.parent.process.start(self.metadata.value, args)
-            self.parent.process.waitForFinished()
-            if not self.parent.process.exitCode() == 0:
+            alive = None
+            verification = self.metadata.verification["alive"]
+            timeout = verification.get("timeout", 5.0)
+            # The cli connects and answers slower than a socket ping
+            cli_timeout = verification.get("cli_timeout", timeout)
+            # Ask the daemon directly; fall back to the cli only when no socket could be reached
+            if "probe" in verification:
+                alive = verification["probe"](timeout=timeout)
+            if alive is None:
+                args = verification["args"].split(" ")
+                self.parent.init_process()
+                self.parent.process.start(self.metadata.value, args)
+                if not self.parent.process.waitForFinished(int(cli_timeout * 1000)):
+                    self.parent.process.kill()
+                    self.parent.process.waitForFinished()
+                alive = self.parent.process.exitCode() == 0
+            if not alive:
                 self.__toggle_checkbox__(False)
 
     def __config_validate__(self, value=None):
@@ -126,8 +150,17 @@ class MainWindow(QMainWindow):
         self.message_prefix = None
         self.message_postfix = None
         self.capture = None
+        self.limiter = RateLimiter()
+        self.retry_policy = RetryPolicy()
+        self.retry_stats = RetryStats()
+        self.metrics = None
+        self.estimate = None
+        self.prefetch = None
+        self.cancel = None
         self.app = self.kwargs["app"]
         self.args = Initialize(self.kwargs["arguments"])
+        self.history = JobHistory(self.args.arguments["config"]["state"].value)
+        self.runlog = RunLog(self.args.arguments["config"]["logs"].value)
         self.height = 800
         self.width = 740
         self.layout = QGridLayout()
@@ -175,6 +208,8 @@ class MainWindow(QMainWindow):
         self.output = QTextEdit()
         self.output.setReadOnly(True)
         self.output.setFontPointSize(15)
+        # Keep memory flat: older lines are dropped from the window, the full output is in the run log
+        self.output.document().setMaximumBlockCount(int(self.args.arguments["config"]["output_lines"].value))
         output_layout.addWidget(output_label)
         output_layout.addWidget(self.output)
 
@@ -185,11 +220,22 @@ class MainWindow(QMainWindow):
         self.button_cancel.setFixedHeight(40)
         self.button_start = QPushButton("Start")
         self.button_start.setFixedHeight(40)
+        self.button_discover = QPushButton("Discover")
+        self.button_discover.setFixedHeight(40)
+        self.button_discover.setToolTip("Discover the accounts and roles of an AWS SSO start URL and generate profiles.")
+        self.button_log = QPushButton("Open Log")
+        self.button_log.setFixedHeight(40)
+        self.button_log.setToolTip("Open the full output log of the last run.")
+        self.button_log.setEnabled(False)
         self.buttongroup.addButton(self.button_cancel, 0)
         self.buttongroup.addButton(self.button_start, 1)
+        self.buttongroup.addButton(self.button_discover, 2)
+        self.buttongroup.addButton(self.button_log, 3)
         self.buttongroup.setExclusive(True)
 
         buttons_layout.addWidget(self.buttongroup.button(0))
+        buttons_layout.addWidget(self.buttongroup.button(2))
+        buttons_layout.addWidget(self.buttongroup.button(3))
         buttons_layout.addWidget(self.buttongroup.button(1))
 
         self.layout.addWidget(optionsgroup, 0, 0, 1, 2)
@@ -214,6 +260,8 @@ class MainWindow(QMainWindow):
         self.__load_ui_config__()
         self.__show_messages__()
         self.__check_update__()
+        self.__sync_config_fragments__()
+        self.__start_prefetch__()
         platform_name = platform.system().lower()
         self.__statusbar_message__(f"Platform: {platform_name} | AWS Profiles: {len(self.args.profiles)} | EKS Profiles: {len(self.args.kube_configs)}", 0)
 
@@ -258,7 +306,7 @@ class MainWindow(QMainWindow):
                 button=self.button_start,
                 options=self.options,
             )
-            self.options[key].setToolTip(meta.help)
+            self.options[key].setToolTip(self.__option_tooltip__(key, meta))
             if not meta.enabled:
                 self.options[key].setEnabled(False)
                 self.options[key].setChecked(False)
@@ -266,6 +314,15 @@ class MainWindow(QMainWindow):
 
             self.options_layout.addWidget(self.options[key])
 
+    def __option_tooltip__(self, key, meta):
+        """ The help of an option, with the config files (and fragments) it reads """
+        layers = {"do_login": [self.args.aws_layers], "do_ecr": [self.args.aws_layers], "do_cart": [self.args.aws_layers],
+                  "do_eks": [self.args.aws_layers, self.args.eks_layers]}.get(key, [])
+        files = [config_file for layer in layers if layer for config_file in reversed(layer.files)]
+        if not files:
+            return meta.help
+        return f"{meta.help}\nConfig files (highest precedence first):\n" + "\n".join(files)
+
     def __load_ui_profiles__(self):
         for name, profile in self.args.profiles.items():
             self.aws_profiles[name] = QCheckBoxProfiles(
@@ -273,7 +330,15 @@ class MainWindow(QMainWindow):
                 button=self.button_start,
                 options=self.options,
             )
-            self.aws_profiles[name].setToolTip(f"SSO Role: {profile.sso_role_name}")
+            if profile.is_chained:
+                via = " -> ".join(link.name for link in profile.chain[:-1])
+                tooltip = f"Role: {profile.role_arn} (via {via})"
+            else:
+                tooltip = f"SSO Role: {profile.sso_role_name}"
+            tooltip += f"\nSource: {profile.source_file}"
+            if profile.source_overrides:
+                tooltip += f"\nOverrides: {', '.join(profile.source_overrides)}"
+            self.aws_profiles[name].setToolTip(tooltip)
             self.aws_profiles[name].stateChanged.connect(self.checkbox_changed)
 
             self.profiles_layout.addWidget(self.aws_profiles[name])
@@ -291,13 +356,36 @@ class MainWindow(QMainWindow):
             self.config_layout.addWidget(self.config[key])
 
 
+    def __stop__(self):
+        """ Cancel the queued prefetch lookups and the running engine, so the app exits without draining them """
+        if self.prefetch:
+            self.prefetch.stop()
+        if self.cancel:
+            self.cancel.set()
+
+    def closeEvent(self, event):
+        """ Closing the window (title bar) stops the background work like the Exit button """
+        self.__stop__()
+        super().closeEvent(event)
+
     def button_clicked(self, button):
         """ Process the button clicks. """
         if button.text() == "Exit":
+            self.__stop__()
             QApp.quit()
         elif button.text() == "Start":
             button.setEnabled(False)
+            self.button_discover.setEnabled(False)
             self.run()
+        elif button.text() == "Discover":
+            button.setEnabled(False)
+            self.button_start.setEnabled(False)
+            self.discover()
+            self.button_start.setEnabled(True)
+            button.setEnabled(True)
+        elif button.text() == "Open Log":
+            if self.runlog.path:
+                QtGui.QDesktopServices.openUrl(QUrl.fromLocalFile(self.runlog.path))
 
     def checkbox_changed(self, state):
         """ Process the checkbox clicks. """
@@ -309,6 +397,38 @@ class MainWindow(QMainWindow):
 
         # Set the start button to enabled if any checkbox is checked.
         self.buttongroup.button(1).setEnabled(any_checked)
+        self.__update_prefetch__()
+
+    def __sync_config_fragments__(self):
+        """ The aws cli only reads the aws config file: copy the profiles from its fragments into it """
+        if not self.args.aws_layers:
+            return
+        try:
+            if self.args.aws_layers.write_fragments():
+                self.message(f"Profiles from {self.args.aws_layers.path}.d updated in: {self.args.aws_layers.path}")
+        except Exception as e:
+            self.message(f"[WARNING] Unable to write the config fragments to {self.args.aws_layers.path}: {e}")
+
+    def __start_prefetch__(self):
+        """ Start the read-only lookups of the run in the background while the user chooses options """
+        if self.prefetch:
+            self.prefetch.stop()
+            self.prefetch = None
+        if not self.args.arguments["cmd"]["awscli"].value:
+            return
+        self.prefetch = Prefetch(
+            self.args.profiles, self.args.kube_configs,
+            self.args.arguments["cmd"]["awscli"].value, self.args.arguments["cmd"]["kubectl"].value,
+            self.limiter, self.retry_policy
+        )
+        self.__update_prefetch__()
+
+    def __update_prefetch__(self):
+        """ Follow the checked profiles/services: unchecked ones are discarded, checked ones prefetched """
+        if not self.prefetch:
+            return
+        services = [service for service, option in (("ecr", "do_ecr"), ("eks", "do_eks")) if self.options[option].isChecked()]
+        self.prefetch.update([name for name, checkbox in self.aws_profiles.items() if checkbox.isChecked()], services)
 
     def __show_messages__(self):
         for section in self.args.arguments:
@@ -318,207 +438,198 @@ class MainWindow(QMainWindow):
                         self.message(error)
 
 
+    def __start_log__(self, name):
+        """ Start streaming the output to a new run log """
+        try:
+            self.runlog.start(name)
+            self.button_log.setEnabled(True)
+        except Exception as e:
+            self.message(f"[WARNING] Unable to create run log: {e}")
+
     def run(self):
         self.output.clear()
         self.statusbar.clearMessage()
-        progress_increment = int(100 / len(self.args.profiles))
+        self.__start_log__("run")
+        self.retry_stats = RetryStats()
+        self.metrics = RunMetrics(
+            self.args.arguments["config"]["metrics"].value,
+            self.args.arguments["config"]["state"].value
+        )
+        steps = [step for step, option in STEP_OPTIONS if self.options[option].isChecked()]
+        self.cancel = threading.Event()
+        engine = Engine(
+            self.args, [profile for name, profile in self.args.profiles.items() if self.aws_profiles[name].isChecked()],
+            self.limiter, self.retry_policy, self.retry_stats, self.history, self.prefetch, cancel=self.cancel
+        )
+        self.estimate = RunEstimate(self.history)
+        for service, keys in engine.plan(steps).items():
+            self.estimate.plan(service, keys)
         self.progressbar.show()
+        self.__progress__()
 
         self.message("Starting Login and Authorization Process...")
-
-        # SSO Login
-        if self.options["do_login"].isChecked():
-            for name, profile in self.args.profiles.items():
-                if not hasattr(profile, "sso_start_url") or not profile.sso_start_url:
-                    self.message(f"- [{name}]: SSO Start URL not found. Skipping...")
-                    continue
-                if self.aws_profiles[name].isChecked() and profile.enabled and profile.sso_role_name:
-                    self.message("------------------------------------------------------------------------------")
-                    self.message(f"Logging into AWS SSO for profile: {name}")
-                    self.message("------------------------------------------------------------------------------")
-                    self.init_process(ready_read=True)
-                    self.call_program(
-                        command=f"{self.args.arguments['cmd']['awscli'].value}",
-                        args=[
-                            "--profile", f"{profile.name}",
-                            "--region", f"{profile.region}","sso",
-                            "login",
-                            '--no-cli-pager', '--no-paginate',
-                            '--cli-read-timeout', '120',
-                            '--no-cli-auto-prompt',
-                            '--color', 'off',
-                            '--output', 'text'
-                        ]
-                    )
-                    self.process.waitForStarted()
-                    self.handle_stdout_wait()
-                    self.process.waitForFinished()
-                    self.message("------------------------------------------------------------------------------<br/>")
-                    self.progressbar.setValue(self.progressbar.value() + 1)
-
-                self.progressbar.setValue( self.progressbar.value() + progress_increment)
-                # self.output.clear()
-                self.message(f"AWS SSO Login Completed for profile: {name}")
-            self.progressbar.setValue(0)
-            self.message("AWS SSO Login Completed.<br/>")
-
-        # ECR Login
-        if self.options["do_ecr"].isChecked():
-            self.message("<strong>Begin ECR Login. Please wait...</strong>")
-            for name, profile in self.args.profiles.items():
-                if not hasattr(profile, "sso_account_id") or not profile.sso_account_id:
-                    self.message(f"Profile [{name}] does not have a valid SSO Account ID. Skipping...")
-                    continue
-                if self.aws_profiles[name].isChecked() and profile.enabled and profile.sso_role_name:
-                    self.init_process(capture=True)
-                    self.message_prefix = f"- [{name}]: "
-                    self.call_program(f"{self.args.arguments['cmd']['awscli'].value}", [
-                        "--profile", f"{profile.name}",
-                        "ecr", "get-login-password",
-                        "--region", f"{profile.region}",
-                        "--no-cli-pager"
-                    ])
-                    self.process.waitForFinished()
-                    self.progressbar.setValue( self.progressbar.value() + int(progress_increment /2))
-                    if self.capture:
-                        profile.ecr_password = self.capture
-                        self.capture = None
-                    if profile.ecr_password:
-                        self.init_process(capture=False, drop_stderr=True)
-                        self.call_program(
-                            f"{self.args.arguments['cmd']['docker'].value}", [
-                            "--log-level", "error",
-                            "login",
-                            "--username",
-                            "AWS",
-                            "--password", f"{profile.ecr_password}",
-                            f"{profile.sso_account_id}.dkr.ecr.{profile.region}.amazonaws.com"
-                            ]
-                        )
-                        self.process.waitForFinished()
-                        self.message_prefix = None
-                    else:
-                        self.message("Failed to get ECR password. Check AWS CLI configuration.")
-
-                self.progressbar.setValue( self.progressbar.value() + int(progress_increment /2))
-            self.progressbar.setValue(0)
-            self.message("AWS ECR Login Completed.<br/>")
-
-        # Kubectl Login
-        self.progressbar.setValue(0)
-        if self.options["do_eks"].isChecked():
-            progress_increment = int(100 / len(self.args.kube_configs))
-            self.message("<strong>Begin kubectl Authorization. Please wait...</strong>")
-            for name, kubeconfig in self.args.kube_configs.items():
-                if self.aws_profiles[kubeconfig.aws_profile.name].isChecked() and kubeconfig.aws_profile and kubeconfig.enable:
-                    # self.message(f"\n<br/><strong>[Kubeconfig: {name}]</strong>")
-                    self.message_prefix = f"- [{name}]: "
-                    self.init_process()
-
-                    # Set the AWS region variable
-                    if hasattr(kubeconfig, "aws_region"):
-                        region = kubeconfig.aws_region
-                    else:
-                        region = kubeconfig.aws_profile.region
-                        print(type(kubeconfig.aws_profile))
-
-                    args = [
-                            "--profile", f"{kubeconfig.aws_profile.name}",
-                            "eks", "update-kubeconfig",
-                            "--name", f"{kubeconfig.eks_cluster}",
-                            "--region", f"{region}",
-                            "--alias", f"{kubeconfig.context}",
-                            "--output", "json"
-                        ]
-                    # Add a role if specified
-                    if hasattr(kubeconfig, "role"):
-                        args.extend(["--role-arn", f"arn:{kubeconfig.aws_partition}:iam::{kubeconfig.aws_profile.sso_account_id}:role/{kubeconfig.eks_cluster}-{kubeconfig.role}"])
-                    # Add a specific kube config file if specified
-                    if hasattr(kubeconfig, "kube_config"):
-                        args.extend(["--kubeconfig", f"{kubeconfig.kube_config}"])
-
-                    self.call_program(f"{self.args.arguments['cmd']['awscli'].value}", args)
-                    self.process.waitForFinished()
-                    self.message_prefix = None
-
-                self.progressbar.setValue( self.progressbar.value() + progress_increment)
-            self.message("AWS EKS Authorization Completed.<br/>")
-
-        if self.options["do_cart"].isChecked():
-            self.message("<strong>Begin AWS CodeArtifact Authorization Token. Please wait...</strong>")
-            for name, profile in self.args.profiles.items():
-                if not profile.code_artifact_domain:
-                    continue
-                self.init_process(capture=True)
-                self.message_prefix = f"- [{name}]: "
-                self.call_program(f"{self.args.arguments['cmd']['awscli'].value}",
-                                  [
-                                        "--profile", f"{profile.name}",
-                                        "codeartifact", "get-authorization-token",
-                                        '--domain', f'{profile.code_artifact_domain}',
-                                        '--domain-owner', f'{profile.sso_account_id}',
-                                        '--region', f"{profile.region}",
-                                        '--query', 'authorizationToken',
-                                        '--output', 'text'
-                                    ]
-                                  )
-                self.process.waitForFinished()
-                self.message_prefix = None
-                self.progressbar.setValue(self.progressbar.value() + 1)
-                self.message("------------------------------------------------------------------------<br/>")
-                self.message("-------------------------[ CodeArtifact Token ]-------------------------<br/>")
-                self.message(f"export CODEARTIFACT_DOMAIN='{profile.code_artifact_domain}'")
-                self.message(f"export CODEARTIFACT_AUTH_TOKEN='{self.capture}'")
-                self.message("---------------------------------------------------------------------<br/>")
-                env_update = EnvCodeArtifactToken(self.capture, profile.code_artifact_domain, profile.code_artifact_env_file)
-                if env_update.written:
-                    self.message(f"CodeArtifact Token Environment Variables Updated in user profile.<br/>File: {env_update.shell_rc}<br/>")
-            self.message("HELP: Use the CodeArtifact token environment variable above to authenticate with CodeArtifact.<br/>")
-            self.message("https://brainspace.atlassian.net/wiki/spaces/BD/pages/2540765185/AWS+CodeArtifact<br/>")
-
-            self.progressbar.setValue(self.progressbar.value() + progress_increment)
-            self.progressbar.setValue(0)
-            self.message("AWS CodeCommit Authenticate Token Completed.<br/>")
-
+        # The engine runs on its own thread and event loop; this loop only renders its events
+        events = queue.Queue()
+        run_in_thread(engine.run(steps), events.put)
+        while True:
+            try:
+                event = events.get_nowait()
+            except queue.Empty:
+                self.__wait__(0.05)
+                continue
+            if event is None:
+                break
+            self.__render__(event)
+
+        summary = self.retry_stats.summary()
+        if summary:
+            self.message("<strong>AWS API Summary</strong>")
+            for line in summary:
+                self.message(f"- {line}")
+        try:
+            self.history.save()
+            metrics_file = self.metrics.finish(self.retry_stats, self.args.profiles)
+            if metrics_file:
+                self.message(f"Run metrics written to: {metrics_file}")
+        except Exception as e:
+            self.message(f"[WARNING] Unable to write run metrics: {e}")
+        if self.runlog.path:
+            self.message(f"Full output: {self.runlog.path}")
+        self.runlog.close()
+        self.cancel = None
         self.__statusbar_message__(f"Completed", add_app_prefix=True)
         self.button_start.setEnabled(True)
+        self.button_discover.setEnabled(True)
         self.progressbar.hide()
 
-    def init_process(self, capture=False, ready_read=False, drop_stderr=False):
-        self.process = None
+    def __render__(self, event):
+        """ Show an engine event in the output and update the progress bar and run metrics from it """
+        if event.status == PROMPT:
+            self.__sso_prompt__(event.data["url"], event.data["user_code"])
+            return
+        if event.status == STARTED:
+            self.message(f"<strong>{event.message}</strong>")
+            return
+        if event.status == DONE:
+            self.message(f"{event.message}<br/>")
+            if event.step == "codeartifact":
+                self.message("HELP: Use the CodeArtifact token environment variable above to authenticate with CodeArtifact.<br/>")
+                self.message("https://brainspace.atlassian.net/wiki/spaces/BD/pages/2540765185/AWS+CodeArtifact<br/>")
+            return
+
+        self.message_prefix = f"- [{event.profile}]: " if event.profile else None
+        if "token" in event.data:
+            self.message("------------------------------------------------------------------------<br/>")
+            self.message("-------------------------[ CodeArtifact Token ]-------------------------<br/>")
+            self.message(f"export CODEARTIFACT_DOMAIN='{event.data['domain']}'")
+            self.message(f"export CODEARTIFACT_AUTH_TOKEN='{event.data['token']}'")
+            self.message("---------------------------------------------------------------------<br/>")
+        elif event.message:
+            self.message(event.message)
+        self.message_prefix = None
+
+        if event.status in (OK, FAILED, SKIPPED):
+            self.metrics.observe(event.step, event.seconds or 0, event.status != FAILED)
+        if event.status == OK and "credential" in event.data:
+            for name in event.data.get("profiles") or [event.profile]:
+                self.metrics.credential(name, event.data["credential"], expires=event.data.get("expires"))
+        if event.key:
+            if event.status == SKIPPED:
+                self.estimate.skip(event.step, [event.key])
+            elif event.status in (OK, FAILED, PROGRESS):
+                self.estimate.complete(event.step, event.key, event.seconds)
+            self.__progress__()
+
+    def __progress__(self):
+        """ Update the progress bar from the estimated work done/remaining """
+        self.progressbar.setValue(self.estimate.percent())
+        remaining = int(self.estimate.remaining())
+        if remaining >= 60:
+            self.progressbar.setFormat(f"%p% | about {remaining // 60}m {remaining % 60}s remaining")
+        else:
+            self.progressbar.setFormat(f"%p% | about {remaining}s remaining")
+        QApp.processEvents()
+
+    def discover(self):
+        """ Discover accounts/roles (and EKS clusters) for a start url and write them to the config files. """
+        start_urls = list(dict.fromkeys(p.sso_start_url for p in self.args.profiles.values() if p.sso_start_url))
+        start_url, ok = QInputDialog.getText(self, "Discover AWS SSO Profiles", "SSO Start URL:", text=start_urls[0] if start_urls else "")
+        if not ok or not start_url.strip():
+            return False
+        start_url = start_url.strip()
+        known = [p for p in self.args.profiles.values() if p.sso_start_url == start_url]
+        sso_region = known[0].sso_region if known and known[0].sso_region else "us-east-1"
+        region = known[0].region if known and known[0].region else sso_region
+        aws_config_file = self.args.arguments["config"]["awscli"].value
+
+        self.output.clear()
+        self.__start_log__("discover")
+        self.retry_stats = RetryStats()
+        self.message(f"<strong>Discovering AWS SSO accounts for {start_url}. Please wait...</strong>")
+        client = SsoClient(sso_region, limiter=self.limiter, retry_policy=self.retry_policy, retry_stats=self.retry_stats)
+        discovery = SsoDiscovery(client, start_url, self.args.arguments["config"]["state"].value, region=region)
+        skip = existing_assignments(aws_config_file, start_url)
+        try:
+            access_token = client.device_login(start_url, on_prompt=self.__sso_prompt__, wait=self.__wait__)
+            changed = discovery.refresh(access_token, wait=self.__wait__)
+            self.message(f"Accounts: {len(discovery.index['accounts'])} | Changed: {len(changed)}")
+            role_errors = dict(discovery.errors)
+            for error in role_errors.values():
+                self.message(f"[WARNING] {error}")
+            if discovery.write_profiles(aws_config_file, skip):
+                self.message(f"Profiles updated in: {aws_config_file}")
+            if self.options["do_eks"].isChecked():
+                listed = discovery.refresh_clusters(
+                    self.args.arguments["cmd"]["awscli"].value,
+                    self.limiter, self.retry_policy, self.retry_stats, wait=self.__wait__, skip=skip
+                )
+                self.message(f"EKS clusters listed for {listed} account(s).")
+                for account_id, error in discovery.errors.items():
+                    if account_id not in role_errors:
+                        self.message(f"[WARNING] {error}")
+                if discovery.write_clusters(self.args.arguments["config"]["eks"].value):
+                    self.message(f"EKS clusters updated in: {self.args.arguments['config']['eks'].value}")
+        except Exception as e:
+            self.message(f"[ERROR] Discovery failed: {e}")
+            self.runlog.close()
+            return False
+        self.__reload_profiles__()
+        self.message("Discovery Completed.<br/>")
+        self.runlog.close()
+        return True
+
+    def __reload_profiles__(self):
+        """ Re-read the configuration files and rebuild the profile checkboxes """
+        for checkbox in self.aws_profiles.values():
+            self.profiles_layout.removeWidget(checkbox)
+            checkbox.deleteLater()
+        self.aws_profiles = {}
+        self.args = Initialize(self.kwargs["arguments"])
+        self.__load_ui_profiles__()
+        self.__sync_config_fragments__()
+        self.__start_prefetch__()
+        self.__statusbar_message__(f"AWS Profiles: {len(self.args.profiles)} | EKS Profiles: {len(self.args.kube_configs)}", 0)
+
+    def __sso_prompt__(self, url, user_code):
+        self.message("Complete the AWS SSO authorization in your browser.")
+        self.message(f"If the browser does not open, visit: <a href='{url}'>{url}</a>")
+        self.message(f"Verification code: <strong>{user_code}</strong>")
+
+    def init_process(self):
+        """ A QProcess whose standard output is captured in self.capture. """
         self.process = QtCore.QProcess(self)
         self.process.setProcessChannelMode(QProcess.ProcessChannelMode.MergedChannels)
         self.process.setReadChannel(QProcess.ProcessChannel.StandardOutput)
-        if ready_read:
-            self.process.readyRead.connect(self.data_ready)
-        if capture:
-            self.process.readyReadStandardOutput.connect(self.handle_stdout_capture)
-        else:
-            self.process.readyReadStandardOutput.connect(self.handle_stdout)
-        if not drop_stderr:
-            self.process.readyReadStandardError.connect(self.handle_stderr)
+        self.process.readyReadStandardOutput.connect(self.handle_stdout_capture)
         self.process.finished.connect(self.process_finished)
-        self.process.started.connect(self.process_started)
         self.process.stateChanged.connect(self.handle_state)
 
-    def data_ready(self):
-        cursor = self.output.textCursor()
-        cursor.movePosition(cursor.MoveOperation.End)
-
-        # Decode the QByteArray
-        sleep(0.5)
-        # print("Reading data...")
-        data = self.process.readAll()
-        stdout = bytes(data).decode("utf8").strip()
-        self.message(stdout)
-
-    def call_program(self, command, args=[], detached=False):
-        # run the process
-        # `start` takes the exec and a list of arguments
-        if detached:
-            self.process.startDetached(command, args)
-        else:
-            self.process.start(command, args)
+    def __wait__(self, seconds):
+        """ Wait without blocking the UI event loop. """
+        deadline = time() + seconds
+        while time() < deadline:
+            QApp.processEvents()
+            sleep(min(0.05, max(0, deadline - time())))
 
     def message(self, message):
         message = str(message.strip())
@@ -528,29 +639,12 @@ class MainWindow(QMainWindow):
             message = f"{message}{self.message_postfix}"
 
         self.output.append(f"{message}")
+        self.runlog.write(message)
         # print(f"{message}")
         self.output.ensureCursorVisible()
         QApp.processEvents()
         return True
 
-    def handle_stderr(self):
-        data = self.process.readAllStandardError()
-        stderr = bytes(data).decode("utf8")
-        self.message(stderr)
-
-    def handle_stdout(self):
-        stdout = None
-        data = self.process.readAllStandardOutput()
-        stdout = bytes(data).decode("utf8").strip()
-        self.message(stdout)
-
-    def handle_stdout_wait(self):
-        self.process.waitForStarted()
-        self.process.waitForBytesWritten()
-        data = self.process.readAllStandardOutput()
-        stdout = bytes(data).decode("utf8").strip()
-        self.message(stdout)
-
     def handle_stdout_capture(self):
         data = self.process.readAllStandardOutput()
         stdout = bytes(data).decode("utf8").strip()
@@ -568,8 +662,6 @@ class MainWindow(QMainWindow):
             # print(f"Setting Status: {state_name}")
             self.pstatus.setText(state_name)
         self.pstate = state_name
-    def process_started(self):
-        pass
 
     def process_finished(self):
         if self.process.exitCode() != 0:
@@ -0,0 +1,165 @@
+"""
+Headless tests of the login engine: the SSO steps run against tools/fake_aws.py,
+the aws cli steps against a small fake `aws` script.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import copy
+import json
+import stat
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+from time import time, sleep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, f"{ROOT}{os.sep}tools")
+
+# The config paths are resolved on import: never let them point at the real home
+HOME = tempfile.mkdtemp(prefix="aws-sso-login-test-")
+os.environ["HOME"] = HOME
+os.environ["USERPROFILE"] = HOME
+
+from fake_aws import FakeAws, Scenario
+from config import ARGUMENTS
+from lib.classes import Initialize
+from lib.engine import Engine, STARTED, DONE, RETRY, OK, FAILED, CANCELLED
+from lib.schedule import JobHistory
+from lib.sso import SsoClient
+from lib.throttle import RateLimiter, RetryPolicy, RetryStats
+
+START_URL = "https://fake.awsapps.com/start"
+REGION = "us-east-1"
+FIRST_ACCOUNT = 100000000000
+# Stands in for the aws cli: FAKE_AWS_MODE picks the answer, every call is logged to $HOME/aws-calls.log
+AWS_STUB = f"""#!{sys.executable}
+import os, sys, time
+home = os.environ["HOME"]
+with open(os.path.join(home, "aws-calls.log"), "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+with open(os.path.join(home, "aws-calls.log")) as f:
+    calls = len(f.readlines())
+mode = os.environ.get("FAKE_AWS_MODE", "ok")
+if mode == "throttle-once" and calls == 1:
+    print("An error occurred (ThrottlingException) when calling the GetAuthorizationToken operation: Rate exceeded", file=sys.stderr)
+    sys.exit(255)
+if mode == "hang":
+    time.sleep(30)
+print("ecr-password")
+"""
+
+def collect(engine, steps):
+    """ Run the engine and return its events """
+    async def drain():
+        return [event async for event in engine.run(steps)]
+    return asyncio.run(drain())
+
+class EngineTest(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix="home-", dir=HOME)
+        self.environ = dict(os.environ)
+        self.bin_dir = f"{self.home}{os.sep}bin"
+        os.makedirs(self.bin_dir)
+        os.makedirs(f"{self.home}{os.sep}.aws")
+        with open(f"{self.bin_dir}{os.sep}aws", "w") as f:
+            f.write(AWS_STUB)
+        os.chmod(f"{self.bin_dir}{os.sep}aws", stat.S_IRWXU)
+        os.environ.update({
+            "HOME": self.home,
+            "USERPROFILE": self.home,
+            "PATH": f"{self.bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            "DOCKER_CONFIG": f"{self.home}{os.sep}.docker",
+        })
+        self.fake = None
+
+    def tearDown(self):
+        if self.fake:
+            self.fake.stop()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def start_fake(self, **scenario):
+        """ Start the fake AWS endpoint and login to it, so the engine finds a cached token """
+        self.fake = FakeAws(Scenario(**scenario)).start()
+        os.environ.update(self.fake.environment())
+        SsoClient(REGION).device_login(START_URL, open_browser=False, wait=lambda seconds: sleep(min(seconds, 0.05)))
+
+    def initialize(self, profiles):
+        """ Write SSO profiles for the fake accounts and load them """
+        config_file = f"{self.home}{os.sep}.aws{os.sep}config"
+        with open(config_file, "w") as f:
+            for idx in range(profiles):
+                f.write(
+                    f"[profile p{idx}]\nsso_start_url = {START_URL}\nsso_region = {REGION}\n"
+                    f"sso_account_id = {FIRST_ACCOUNT + idx}\nsso_role_name = Admin\nregion = {REGION}\n\n"
+                )
+        arguments = copy.deepcopy(ARGUMENTS)
+        arguments["config"]["awscli"].value = config_file
+        arguments["config"]["state"].value = f"{self.home}{os.sep}state"
+        return Initialize(arguments)
+
+    def aws_calls(self):
+        try:
+            with open(f"{self.home}{os.sep}aws-calls.log") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def test_login_events(self):
+        self.start_fake(accounts=5, roles=("Admin",), latency=0)
+        history = JobHistory(f"{self.home}{os.sep}state")
+        for idx in range(5):
+            history.record("login", f"p{idx}", 10 if idx == 3 else 1)
+        engine = Engine(self.initialize(5), history=history, max_concurrency=2)
+        events = collect(engine, ["login"])
+
+        self.assertEqual(events[0].status, STARTED)
+        self.assertEqual(events[-1].status, DONE)
+        ok = [event for event in events if event.status == OK]
+        self.assertEqual(sorted(event.profile for event in ok), [f"p{idx}" for idx in range(5)])
+        # The slowest profile by the job history is submitted (and reported) first
+        self.assertEqual(ok[0].profile, "p3")
+        self.assertEqual(self.fake.requests.get("GetRoleCredentials"), 5)
+
+    def test_cancel_stops_queued_work(self):
+        self.start_fake(accounts=60, roles=("Admin",), latency=0.2, jitter=0)
+        cancel = threading.Event()
+        engine = Engine(self.initialize(60), limiter=RateLimiter({"sso": (1000.0, 1000)}), max_concurrency=2, cancel=cancel)
+        threading.Timer(0.5, cancel.set).start()
+        started = time()
+        events = collect(engine, ["login"])
+
+        self.assertEqual(events[-1].status, CANCELLED)
+        # The event stream ends soon after the cancel, without running the queued profiles
+        self.assertLess(time() - started, 2.5)
+        self.assertLess(self.fake.requests.get("GetRoleCredentials", 0), 60)
+
+    def test_ecr_throttle_is_retried(self):
+        os.environ["FAKE_AWS_MODE"] = "throttle-once"
+        retry_stats = RetryStats()
+        engine = Engine(self.initialize(1), retry_policy=RetryPolicy(base_delay=0.01), retry_stats=retry_stats)
+        events = collect(engine, ["ecr"])
+
+        self.assertEqual([event.status for event in events if event.status in (RETRY, OK, FAILED)], [RETRY, OK])
+        self.assertEqual(len(self.aws_calls()), 2)
+        self.assertEqual(retry_stats.throttles.get("ecr"), 1)
+        with open(f"{self.home}{os.sep}.docker{os.sep}config.json") as f:
+            self.assertIn(f"{FIRST_ACCOUNT}.dkr.ecr.{REGION}.amazonaws.com", json.load(f)["auths"])
+
+    def test_timeout_is_not_retried(self):
+        os.environ["FAKE_AWS_MODE"] = "hang"
+        engine = Engine(self.initialize(1), retry_policy=RetryPolicy(base_delay=0.01), timeout=0.5)
+        events = collect(engine, ["ecr"])
+
+        self.assertNotIn(RETRY, [event.status for event in events])
+        self.assertEqual([event.status for event in events if event.status in (OK, FAILED)], [FAILED])
+        self.assertEqual(len(self.aws_calls()), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Local fake of the AWS APIs used by aws-sso-login, for offline load testing.
+
+Implements SSO OIDC (RegisterClient, StartDeviceAuthorization, CreateToken),
+the SSO portal (GetRoleCredentials, ListAccounts, ListAccountRoles), ECR
+(GetAuthorizationToken), EKS (ListClusters, DescribeCluster), CodeArtifact
+(GetAuthorizationToken, GetRepositoryEndpoint) and STS (AssumeRole) on a single endpoint, with
+configurable latency, error rate and throttling. Point the tool at it with
+AWS_SSO_LOGIN_OIDC_ENDPOINT / AWS_SSO_LOGIN_PORTAL_ENDPOINT and the aws cli's
+AWS_ENDPOINT_URL_<SERVICE> variables (see `FakeAws.environment`).
+"""
+import re
+import sys
+import json
+import base64
+import random
+import argparse
+import threading
+from time import time, sleep
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ECR_TARGET = "AmazonEC2ContainerRegistry_V20150921.GetAuthorizationToken"
+CREDENTIAL_SCOPE_RE = re.compile(r"Credential=[^/]+/\d+/([^/]+)/([^/]+)/aws4_request")
+
+class FakeError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+class Bucket:
+    """ Token bucket used to throttle each fake service """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class Scenario:
+    def __init__(self, accounts=500, roles=("Admin", "ReadOnly"), clusters=2, latency=0.02, jitter=0.01,
+                 slow_regions=None, error_rate=0.0, throttle_rate=0, approve_after=1, seed=None):
+        self.accounts = accounts
+        self.roles = list(roles)
+        self.clusters = clusters
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_regions = slow_regions or {}
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.approve_after = approve_after
+        self.random = random.Random(seed)
+
+class FakeAws:
+    def __init__(self, scenario=None, host="127.0.0.1", port=0):
+        self.scenario = scenario or Scenario()
+        self.buckets = {}
+        self.requests = {}
+        self.throttled = {}
+        self.errors = {}
+        self.device_polls = {}
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.handle(self, "GET")
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def environment(self):
+        """ Environment variables that point aws-sso-login and the aws cli at this fake """
+        return {
+            "AWS_SSO_LOGIN_OIDC_ENDPOINT": self.url,
+            "AWS_SSO_LOGIN_PORTAL_ENDPOINT": self.url,
+            "AWS_ENDPOINT_URL_SSO_OIDC": self.url,
+            "AWS_ENDPOINT_URL_SSO": self.url,
+            "AWS_ENDPOINT_URL_ECR": self.url,
+            "AWS_ENDPOINT_URL_EKS": self.url,
+            "AWS_ENDPOINT_URL_CODEARTIFACT": self.url,
+            "AWS_ENDPOINT_URL_STS": self.url,
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # -- helpers ---------------------------------------------------------------
+
+    def account_ids(self):
+        return [f"{100000000000 + idx}" for idx in range(self.scenario.accounts)]
+
+    def __count__(self, counter, operation):
+        with self.lock:
+            counter[operation] = counter.get(operation, 0) + 1
+
+    def __bucket__(self, service):
+        with self.lock:
+            if service not in self.buckets:
+                self.buckets[service] = Bucket(self.scenario.throttle_rate)
+            return self.buckets[service]
+
+    def __delay__(self, region):
+        scenario = self.scenario
+        delay = scenario.latency + scenario.random.uniform(0, scenario.jitter) + scenario.slow_regions.get(region, 0)
+        if delay > 0:
+            sleep(delay)
+
+    def __send__(self, handler, status, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def __error__(self, handler, service, error):
+        if service == "sts":
+            body = (
+                f"<ErrorResponse><Error><Type>Sender</Type><Code>{error.code}</Code>"
+                f"<Message>{error.message}</Message></Error><RequestId>fake</RequestId></ErrorResponse>"
+            ).encode("utf-8")
+            return self.__send__(handler, error.status, body, "text/xml")
+        body = {"__type": error.code, "message": error.message, "error": error.code}
+        self.__send__(handler, error.status, body, headers={"x-amzn-ErrorType": error.code})
+
+    def __route__(self, method, path, headers, raw=b""):
+        """ Return (service, operation) for a request """
+        if b"Action=AssumeRole" in raw:
+            return "sts", "AssumeRole"
+        if path.startswith("/client/register"):
+            return "sso-oidc", "RegisterClient"
+        if path.startswith("/device_authorization"):
+            return "sso-oidc", "StartDeviceAuthorization"
+        if path.startswith("/token"):
+            return "sso-oidc", "CreateToken"
+        if path.startswith("/federation/credentials"):
+            return "sso", "GetRoleCredentials"
+        if path.startswith("/assignment/accounts"):
+            return "sso", "ListAccounts"
+        if path.startswith("/assignment/roles"):
+            return "sso", "ListAccountRoles"
+        if headers.get("X-Amz-Target") == ECR_TARGET:
+            return "ecr", "GetAuthorizationToken"
+        if path == "/clusters":
+            return "eks", "ListClusters"
+        if path.startswith("/clusters/"):
+            return "eks", "DescribeCluster"
+        if path.startswith("/v1/authorization-token"):
+            return "codeartifact", "GetAuthorizationToken"
+        if path.startswith("/v1/repository/endpoint"):
+            return "codeartifact", "GetRepositoryEndpoint"
+        return None, None
+
+    def handle(self, handler, method):
+        url = urlparse(handler.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length else b""
+        service, operation = self.__route__(method, url.path, handler.headers, raw)
+        if not operation:
+            return self.__error__(handler, "unknown", FakeError(404, "UnknownOperationException", f"{method} {url.path}"))
+
+        scope = CREDENTIAL_SCOPE_RE.search(handler.headers.get("Authorization", ""))
+        region = scope.group(1) if scope else "us-east-1"
+        self.__count__(self.requests, operation)
+        self.__delay__(region)
+
+        try:
+            # CreateToken polls are not throttled/failed so device authorization stays deterministic
+            if operation != "CreateToken":
+                if not self.__bucket__(service).take():
+                    self.__count__(self.throttled, operation)
+                    if service in ("sso", "sso-oidc"):
+                        raise FakeError(429, "TooManyRequestsException", "Too many requests")
+                    if service == "sts":
+                        raise FakeError(400, "Throttling", "Rate exceeded")
+                    raise FakeError(400 if service == "ecr" else 429, "ThrottlingException", "Rate exceeded")
+                if self.scenario.random.random() < self.scenario.error_rate:
+                    self.__count__(self.errors, operation)
+                    raise FakeError(500, "InternalFailure", "Injected failure")
+            if raw and raw.strip().startswith(b"{"):
+                body = json.loads(raw)
+            else:
+                body = {key: values[0] for key, values in parse_qs(raw.decode("utf-8")).items()}
+            response = getattr(self, f"op_{operation}")(body=body, query=query, path=url.path, region=region)
+        except FakeError as e:
+            return self.__error__(handler, service, e)
+        content_type = {"ecr": "application/x-amz-json-1.1", "sts": "text/xml"}.get(service, "application/json")
+        self.__send__(handler, 200, response, content_type)
+
+    # -- SSO OIDC --------------------------------------------------------------
+
+    def op_RegisterClient(self, body, **kwargs):
+        return {
+            "clientId": f"fake-client-{int(time())}",
+            "clientSecret": "fake-secret",
+            "clientIdIssuedAt": int(time()),
+            "clientSecretExpiresAt": int(time()) + 90 * 86400,
+        }
+
+    def op_StartDeviceAuthorization(self, body, **kwargs):
+        device_code = f"device-{random.random()}"
+        with self.lock:
+            self.device_polls[device_code] = 0
+        return {
+            "deviceCode": device_code,
+            "userCode": "FAKE-CODE",
+            "verificationUri": f"{self.url}/device",
+            "verificationUriComplete": f"{self.url}/device?user_code=FAKE-CODE",
+            "expiresIn": 600,
+            "interval": 1,
+        }
+
+    def op_CreateToken(self, body, **kwargs):
+        device_code = body.get("deviceCode")
+        with self.lock:
+            if device_code not in self.device_polls:
+                raise FakeError(400, "invalid_grant", "Unknown device code")
+            self.device_polls[device_code] += 1
+            polls = self.device_polls[device_code]
+        if polls < self.scenario.approve_after:
+            raise FakeError(400, "authorization_pending", "Authorization pending")
+        return {"accessToken": f"fake-access-token-{device_code}", "tokenType": "Bearer", "expiresIn": 28800}
+
+    # -- SSO portal ------------------------------------------------------------
+
+    def op_GetRoleCredentials(self, query, **kwargs):
+        if query.get("account_id") not in self.account_ids():
+            raise FakeError(403, "ForbiddenException", "No access")
+        return {"roleCredentials": {
+            "accessKeyId": f"ASIAFAKE{query['account_id']}",
+            "secretAccessKey": "fake-secret-access-key",
+            "sessionToken": "fake-session-token",
+            "expiration": int((time() + 3600) * 1000),
+        }}
+
+    def __page__(self, items, query):
+        start = int(query.get("next_token") or 0)
+        size = int(query.get("max_result") or 100)
+        page = {"items": items[start:start + size]}
+        if start + size < len(items):
+            page["nextToken"] = str(start + size)
+        return page
+
+    def op_ListAccounts(self, query, **kwargs):
+        accounts = [
+            {"accountId": account_id, "accountName": f"Account {idx}", "emailAddress": f"account{idx}@example.com"}
+            for idx, account_id in enumerate(self.account_ids())
+        ]
+        page = self.__page__(accounts, query)
+        return {"accountList": page.pop("items"), **page}
+
+    def op_ListAccountRoles(self, query, **kwargs):
+        roles = [{"roleName": role, "accountId": query.get("account_id")} for role in self.scenario.roles]
+        page = self.__page__(roles, query)
+        return {"roleList": page.pop("items"), **page}
+
+    # -- ECR / EKS / CodeArtifact ----------------------------------------------
+
+    def op_GetAuthorizationToken(self, body=None, query=None, path="", region="us-east-1", **kwargs):
+        if path.startswith("/v1/"):
+            return {"authorizationToken": f"fake-codeartifact-token-{query.get('domain')}", "expiration": time() + 43200}
+        token = base64.b64encode(b"AWS:fake-ecr-password").decode("ascii")
+        return {"authorizationData": [{
+            "authorizationToken": token,
+            "expiresAt": time() + 43200,
+            "proxyEndpoint": f"https://000000000000.dkr.ecr.{region}.amazonaws.com",
+        }]}
+
+    def op_ListClusters(self, region="us-east-1", **kwargs):
+        return {"clusters": [f"cluster-{idx}" for idx in range(self.scenario.clusters)]}
+
+    def op_DescribeCluster(self, path="", region="us-east-1", **kwargs):
+        name = path.rsplit("/", 1)[-1]
+        return {"cluster": {
+            "name": name,
+            "arn": f"arn:aws:eks:{region}:000000000000:cluster/{name}",
+            "endpoint": f"https://{name}.fake.eks.{region}.amazonaws.com",
+            "status": "ACTIVE",
+            "version": "1.29",
+            "certificateAuthority": {"data": base64.b64encode(b"fake-ca").decode("ascii")},
+        }}
+
+    def op_GetRepositoryEndpoint(self, query, region="us-east-1", **kwargs):
+        domain = query.get("domain")
+        owner = query.get("domain-owner", "000000000000")
+        fmt = query.get("format")
+        repository = query.get("repository")
+        return {"repositoryEndpoint": f"https://{domain}-{owner}.d.codeartifact.{region}.amazonaws.com/{fmt}/{repository}/"}
+
+    # -- STS -------------------------------------------------------------------
+
+    def op_AssumeRole(self, body, **kwargs):
+        role_arn = body.get("RoleArn", "")
+        account_id = role_arn.split(":")[4] if role_arn.count(":") >= 5 else "000000000000"
+        session_name = body.get("RoleSessionName", "session")
+        expiration = datetime.fromtimestamp(time() + int(body.get("DurationSeconds") or 3600), timezone.utc)
+        return (
+            '<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/"><AssumeRoleResult>'
+            f"<Credentials><AccessKeyId>ASIAFAKE{account_id}</AccessKeyId>"
+            "<SecretAccessKey>fake-secret-access-key</SecretAccessKey>"
+            "<SessionToken>fake-session-token</SessionToken>"
+            f"<Expiration>{expiration.strftime('%Y-%m-%dT%H:%M:%SZ')}</Expiration></Credentials>"
+            f"<AssumedRoleUser><AssumedRoleId>AROAFAKE:{session_name}</AssumedRoleId>"
+            f"<Arn>{role_arn}/{session_name}</Arn></AssumedRoleUser>"
+            "</AssumeRoleResult><ResponseMetadata><RequestId>fake</RequestId></ResponseMetadata></AssumeRoleResponse>"
+        ).encode("utf-8")
+
+def parse_slow_regions(values):
+    """ Parse REGION=SECONDS pairs """
+    slow_regions = {}
+    for value in values or []:
+        region, seconds = value.split("=", 1)
+        slow_regions[region] = float(seconds)
+    return slow_regions
+
+def scenario_arguments(parser):
+    """ Add the scenario options to an argument parser """
+    parser.add_argument("--accounts", type=int, default=500, help="Number of accounts assigned to the user.")
+    parser.add_argument("--roles", default="Admin,ReadOnly", help="Comma separated roles per account.")
+    parser.add_argument("--clusters", type=int, default=2, help="EKS clusters per account.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Base latency (seconds) of every call.")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Random extra latency (seconds).")
+    parser.add_argument("--slow-region", action="append", metavar="REGION=SECONDS", help="Extra latency for a region.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with InternalFailure.")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="Calls per second per service before throttling (0 = off).")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed.")
+    return parser
+
+def scenario_from_args(args):
+    return Scenario(
+        accounts=args.accounts,
+        roles=[role.strip() for role in args.roles.split(",") if role.strip()],
+        clusters=args.clusters,
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_regions=parse_slow_regions(args.slow_region),
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+
+if __name__ == "__main__":
+    parser = scenario_arguments(argparse.ArgumentParser(description="Fake AWS endpoint for aws-sso-login"))
+    parser.add_argument("--port", type=int, default=4566)
+    args = parser.parse_args()
+    fake = FakeAws(scenario_from_args(args), port=args.port).start()
+    print(f"Fake AWS listening on {fake.url}")
+    for key, value in fake.environment().items():
+        print(f"export {key}={value}")
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+        sys.exit(0)
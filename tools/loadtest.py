@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Drive the aws-sso-login pipeline against the local fake AWS endpoint and
+report throughput, tail latency and failure handling.
+
+    python tools/loadtest.py --accounts 500 --throttle-rate 50 --error-rate 0.01
+
+The steps run through `Engine.run()`, as in the window, and the stage stats
+are gathered from its events. The run uses a temporary HOME and a stub docker,
+so the real ~/.aws and ~/.docker files are never touched. Stages that need the
+aws cli (chained roles, ECR, EKS, CodeArtifact) are skipped when it is not
+installed. Exits non-zero when the failure rate exceeds --max-failure-rate.
+"""
+import os
+import sys
+import json
+import stat
+import shutil
+import asyncio
+import argparse
+import tempfile
+from time import time, sleep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_aws import FakeAws, scenario_arguments, scenario_from_args
+
+START_URL = "https://fake.awsapps.com/start"
+SSO_REGION = "us-east-1"
+CODEARTIFACT_DOMAIN = "fake-domain"
+# Stage names of the engine steps
+STAGE_NAMES = {
+    "login": "role-credentials",
+    "sts": "assume-role-chain",
+    "ecr": "ecr-login",
+    "eks": "eks-update-kubeconfig",
+    "codeartifact": "codeartifact-token",
+}
+# Stands in for docker: `docker login` reads the password and succeeds
+DOCKER_STUB = """#!/bin/sh
+cat > /dev/null
+exit 0
+"""
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[idx]
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.ok = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.calls = 0
+        self.started = time()
+        self.wall = 0.0
+        self.note = ""
+
+    def record(self, seconds, success):
+        self.durations.append(seconds)
+        if success:
+            self.ok += 1
+        else:
+            self.failed += 1
+
+    def report(self):
+        jobs = self.ok + self.failed
+        return {
+            "stage": self.name,
+            "jobs": jobs,
+            "ok": self.ok,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "retries": self.retries,
+            "wall_seconds": round(self.wall, 3),
+            "throughput_per_second": round(jobs / self.wall, 2) if self.wall else 0,
+            "p50": round(percentile(self.durations, 50), 3),
+            "p95": round(percentile(self.durations, 95), 3),
+            "p99": round(percentile(self.durations, 99), 3),
+            "max": round(max(self.durations), 3) if self.durations else 0,
+            "note": self.note,
+        }
+
+def run_engine(engine, steps, history):
+    """ Run engine steps and gather {step: Stage} from their events, the way the window renders them """
+    from lib.engine import STARTED, DONE, RETRY, PROGRESS, OK, FAILED, SKIPPED
+
+    stages = {}
+    errors = []
+
+    async def drain():
+        async for event in engine.run(steps):
+            if event.step == "run":
+                errors.append(event.message)
+                continue
+            stage = stages.setdefault(event.step, Stage(STAGE_NAMES.get(event.step, event.step)))
+            if event.status == STARTED:
+                stage.started = time()
+            elif event.status == DONE:
+                stage.wall = time() - stage.started
+                if event.step == "sts":
+                    stage.note = event.message
+            elif event.status in (OK, FAILED):
+                stage.record(event.seconds or 0, event.status == OK)
+            elif event.status == SKIPPED:
+                stage.skipped += 1
+            elif event.status == RETRY:
+                stage.retries += 1
+            elif event.status == PROGRESS:
+                stage.calls += 1
+            if event.key and event.seconds is not None and event.status in (OK, FAILED, PROGRESS):
+                history.record(event.step, event.key, event.seconds)
+
+    asyncio.run(drain())
+    if "ecr" in stages:
+        stages["ecr"].note = f"{stages['ecr'].calls} tokens fetched"
+    return stages, errors
+
+def main():
+    parser = scenario_arguments(argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter))
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent jobs (default: the tool's MAX_WORKERS).")
+    parser.add_argument("--cli-limit", type=int, default=20, help="Maximum profiles/clusters driven through the aws cli per stage.")
+    parser.add_argument("--no-cli", action="store_true", help="Skip the stages that need the aws cli.")
+    parser.add_argument("--ecr-regions", default="us-west-2,eu-west-1", help="Extra ECR regions (ecr_regions) of the profiles driven through the aws cli.")
+    parser.add_argument("--chained", type=int, default=10, help="Chained (source_profile) profiles sharing one intermediate role.")
+    parser.add_argument("--max-failure-rate", type=float, default=0.0, help="Fail when more than this fraction of jobs fail.")
+    parser.add_argument("--json", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    fake = FakeAws(scenario_from_args(args)).start()
+    home = tempfile.mkdtemp(prefix="aws-sso-login-loadtest-")
+    # Isolate every file the tool and the aws cli touch, before the tool's modules read Path.home()
+    os.environ.update(fake.environment())
+    os.environ.update({
+        "HOME": home,
+        "USERPROFILE": home,
+        "AWS_CONFIG_FILE": f"{home}{os.sep}.aws{os.sep}config",
+        "AWS_SHARED_CREDENTIALS_FILE": f"{home}{os.sep}.aws{os.sep}credentials",
+        "AWS_EC2_METADATA_DISABLED": "true",
+        "AWS_SSO_LOGIN_METRICS_FILE": f"{home}{os.sep}aws-sso-login.prom",
+    })
+    os.makedirs(f"{home}{os.sep}.aws", exist_ok=True)
+
+    import copy
+    from config import ARGUMENTS
+    from lib.classes import Initialize
+    from lib.sso import SsoClient
+    from lib.engine import Engine
+    from lib.discovery import SsoDiscovery
+    from lib.codeartifact import set_ini_option
+    from lib.throttle import RateLimiter, RetryPolicy, RetryStats
+    from lib.schedule import JobHistory, MAX_WORKERS
+
+    workers = args.workers or MAX_WORKERS
+    limiter = RateLimiter()
+    retry_policy = RetryPolicy()
+    retry_stats = RetryStats()
+    state_dir = ARGUMENTS["config"]["state"].value
+    history = JobHistory(state_dir)
+    stages = []
+    errors = []
+
+    # The engine's docker fallback runs a stub, so no docker daemon is needed
+    bin_dir = f"{home}{os.sep}bin"
+    os.makedirs(bin_dir, exist_ok=True)
+    with open(f"{bin_dir}{os.sep}docker", "w") as f:
+        f.write(DOCKER_STUB)
+    os.chmod(f"{bin_dir}{os.sep}docker", stat.S_IRWXU)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["DOCKER_CONFIG"] = f"{home}{os.sep}.docker"
+
+    def initialize():
+        arguments = copy.deepcopy(ARGUMENTS)
+        arguments["config"]["awscli"].value = os.environ["AWS_CONFIG_FILE"]
+        return Initialize(arguments)
+
+    def engine(init, profiles):
+        return Engine(init, profiles, limiter, retry_policy, retry_stats, history, max_concurrency=workers)
+
+    try:
+        client = SsoClient(SSO_REGION, limiter=limiter, retry_policy=retry_policy, retry_stats=retry_stats)
+
+        # Logs in once; the engine reuses the cached token
+        stage = Stage("sso-device-login")
+        started = time()
+        access_token = client.device_login(START_URL, open_browser=False, wait=lambda seconds: sleep(min(seconds, 0.1)))
+        stage.record(time() - started, bool(access_token))
+        stage.wall = time() - started
+        stages.append(stage)
+
+        stage = Stage("discovery")
+        started = time()
+        discovery = SsoDiscovery(client, START_URL, state_dir, region=SSO_REGION, max_workers=workers)
+        changed = discovery.refresh(access_token)
+        discovery.write_profiles(os.environ["AWS_CONFIG_FILE"])
+        stage.wall = time() - started
+        stage.record(stage.wall, True)
+        stage.note = f"{len(discovery.index['accounts'])} accounts, {len(changed)} changed"
+        stages.append(stage)
+
+        stage = Stage("discovery-incremental")
+        role_calls = fake.requests.get("ListAccountRoles", 0)
+        started = time()
+        changed = SsoDiscovery(client, START_URL, state_dir, region=SSO_REGION, max_workers=workers).refresh(access_token)
+        stage.wall = time() - started
+        stage.record(stage.wall, True)
+        stage.note = f"{len(changed)} changed, {fake.requests.get('ListAccountRoles', 0) - role_calls} role listings"
+        stages.append(stage)
+
+        awscli = shutil.which("aws")
+        use_cli = awscli and not args.no_cli
+        profiles = list(initialize().profiles.values())
+        cli_profiles = profiles[:args.cli_limit]
+        if use_cli:
+            # ECR in several regions for the profiles driven through the cli, and one CodeArtifact domain
+            with open(os.environ["AWS_CONFIG_FILE"], "r") as f:
+                text = f.read()
+            for profile in cli_profiles:
+                text = set_ini_option(text, profile.section, "ecr_regions", args.ecr_regions)
+            text = set_ini_option(text, cli_profiles[0].section, "code_artifact_domain", CODEARTIFACT_DOMAIN)
+            if args.chained:
+                base = cli_profiles[0]
+                text += f"\n[profile chain-hop]\nrole_arn = arn:aws:iam::{base.sso_account_id}:role/Hop\nsource_profile = {base.name}\n"
+                for idx in range(args.chained):
+                    text += f"\n[profile chain-{idx}]\nrole_arn = arn:aws:iam::{base.sso_account_id}:role/Leaf{idx}\nsource_profile = chain-hop\n"
+            with open(os.environ["AWS_CONFIG_FILE"], "w") as f:
+                f.write(text)
+            discovery.refresh_clusters(awscli, limiter, retry_policy, retry_stats)
+            discovery.write_clusters(ARGUMENTS["config"]["eks"].value)
+
+        init = initialize()
+        names = set(profile.name for profile in cli_profiles)
+        chained = [p for p in init.profiles.values() if p.is_chained and p.name != "chain-hop"]
+        # Role credentials of every profile (and the role chains), the way the window logs in
+        login, login_errors = run_engine(engine(init, [p for p in init.profiles.values() if not p.is_chained] + chained), ["login"], history)
+        stages.extend(login.values())
+        errors.extend(login_errors)
+
+        if not use_cli:
+            stage = Stage("aws-cli")
+            stage.note = "skipped: aws cli not installed" if not awscli else "skipped: --no-cli"
+            stages.append(stage)
+        else:
+            cli, cli_errors = run_engine(
+                engine(init, [p for p in init.profiles.values() if p.name in names]), ["ecr", "eks", "codeartifact"], history
+            )
+            stages.extend(cli.values())
+            errors.extend(cli_errors)
+    finally:
+        fake.stop()
+
+    report = {
+        "scenario": vars(args),
+        "stages": [stage.report() for stage in stages],
+        "errors": errors,
+        "retries": {
+            service: {
+                "calls": retry_stats.calls[service],
+                "retries": retry_stats.retries.get(service, 0),
+                "throttled": retry_stats.throttles.get(service, 0),
+                "failed": retry_stats.failures.get(service, 0),
+            } for service in sorted(retry_stats.calls)
+        },
+        "fake": {"requests": fake.requests, "throttled": fake.throttled, "errors": fake.errors},
+    }
+    print(f"{'stage':<24}{'jobs':>6}{'ok':>6}{'failed':>8}{'skipped':>9}{'wall s':>9}{'jobs/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}  note")
+    for row in report["stages"]:
+        print(
+            f"{row['stage']:<24}{row['jobs']:>6}{row['ok']:>6}{row['failed']:>8}{row['skipped']:>9}{row['wall_seconds']:>9}"
+            f"{row['throughput_per_second']:>9}{row['p50']:>8}{row['p95']:>8}{row['p99']:>8}{row['max']:>8}  {row['note']}"
+        )
+    for line in retry_stats.summary():
+        print(f"- {line}")
+    for error in errors:
+        print(error)
+    print(f"fake: throttled {sum(fake.throttled.values())}, injected errors {sum(fake.errors.values())}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    shutil.rmtree(home, ignore_errors=True)
+
+    jobs = sum(row["jobs"] for row in report["stages"])
+    failed = sum(row["failed"] for row in report["stages"])
+    if errors or (jobs and failed / jobs > args.max_failure_rate):
+        print(f"FAILED: {failed}/{jobs} jobs failed (max failure rate {args.max_failure_rate})")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())